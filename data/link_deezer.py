@@ -9,7 +9,7 @@ What it does
 - Reads INSERT lines from deezer_track.sql (expected format:
     "INSERT INTO public.deezer_track VALUES ...").
 - Extracts the Deezer track ID and ISRC.
-- Bulk-loads rows into an UNLOGGED temp table using COPY for speed.
+- Bulk-loads rows into a per-batch temporary table using COPY for speed.
 - Inserts into the final table (musicbrainz.deezer) with a primary-key
     constraint on ISRC and ON CONFLICT DO NOTHING.
 
@@ -20,13 +20,16 @@ Input file:
     - deezer_track.sql
 
 Progress tracking:
-    - load_progress.txt
-        Stores the last processed line number so the script can resume after an
-        interruption.
+    - load_segments.txt
+        The dump is split into byte-range segments on line boundaries; each
+        fully loaded segment is appended as "start end". On restart only the
+        missing segments are processed. (The older load_progress.txt is not
+        read; starting over is safe because inserts never overwrite.)
 
 Error logging:
     - error_log.txt
-        Logs malformed lines / parsing problems without stopping the run.
+        Logs malformed lines / parsing problems without stopping the run,
+        keyed by the line's byte offset in the dump.
 
 Database objects created
 ------------------------
@@ -38,16 +41,33 @@ Tables:
     - musicbrainz.deezer
             isrc TEXT PRIMARY KEY
             track_id BIGINT NOT NULL
-    - musicbrainz.deezer_temp_load (UNLOGGED)
+    - deezer_temp_load (TEMPORARY, created per batch and dropped on commit)
             isrc TEXT
             track_id BIGINT
 
 Performance notes
 -----------------
 
-- BATCH_SIZE controls how many parsed rows are buffered before each COPY.
-- PROGRESS_INTERVAL controls how often a status line is printed.
-- The temp table is truncated after each flush.
+- NUM_WORKERS processes parse segments and COPY in parallel, each over its
+    own connection, since a single COPY stream is bound to one server core.
+- SEGMENT_BYTES sets the unit of work and of resumable progress.
+- FLUSH_BYTES controls how much packed COPY data is buffered before each
+    flush, so batches have a steady size regardless of row width.
+- Rows are sent in COPY BINARY format, so the server neither parses track IDs
+    from text nor scans ISRCs for escapes. Each worker packs rows into one
+    long-lived bytearray that is rewound after every flush and streamed to
+    COPY in COPY_CHUNK_SIZE reads. Two such buffers alternate so parsing
+    continues while the previous batch is being sent and committed.
+- The staging table lives only for one batch transaction (ON COMMIT DROP),
+    so there is no TRUNCATE and nothing to clean up after a crash.
+- Loading sessions run with SESSION_SETTINGS (asynchronous commit, larger
+    work_mem) so each batch commit does not wait on a WAL flush.
+- Segments finish in any order, so when the dump holds the same ISRC more
+    than once, which track ID is kept is not fixed.
+- The dump is memory-mapped and each segment is scanned by one multiline
+    regex finditer() directly over the mapping, so non-INSERT lines never
+    reach Python and regular rows are never copied into per-line objects.
+    Only non-ASCII ISRCs are transcoded from latin-1.
 
 Usage
 -----
@@ -62,7 +82,12 @@ Requirements:
 """
 
 import psycopg2
-import io
+import mmap
+import multiprocessing
+import re
+import signal
+import struct
+from concurrent.futures import ThreadPoolExecutor, wait
 import time
 import sys
 import os
@@ -77,7 +102,7 @@ DB_CONFIG = {
 
 # --- File and Table Paths ---
 SQL_FILE_PATH = 'deezer_track.sql'
-PROGRESS_FILE = 'load_progress.txt'
+PROGRESS_FILE = 'load_segments.txt'
 ERROR_LOG_FILE = 'error_log.txt'
 
 # --- Target Schema and Table Names ---
@@ -85,34 +110,121 @@ TARGET_SCHEMA = 'musicbrainz'
 TARGET_TABLE = 'deezer'
 QUALIFIED_TABLE_NAME = f'{TARGET_SCHEMA}.{TARGET_TABLE}'
 TEMP_TABLE_NAME = f'{TARGET_TABLE}_temp_load'
-QUALIFIED_TEMP_TABLE_NAME = f'{TARGET_SCHEMA}.{TEMP_TABLE_NAME}'
 
 # --- Performance Tuning ---
-BATCH_SIZE = 250000
-PROGRESS_INTERVAL = 100000
+NUM_WORKERS = min(8, os.cpu_count() or 1)
+SEGMENT_BYTES = 64 * 1024 * 1024
+FLUSH_BYTES = 16 * 1024 * 1024
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Applied to every loading connection. A crash can lose the last few commits
+# without synchronous_commit, which is fine here: segments are only marked
+# done after their commit returns and reloading a segment is idempotent.
+SESSION_SETTINGS = {
+    "synchronous_commit": "off",
+    "work_mem": "256MB",
+    "maintenance_work_mem": "1GB",
+}
+
+# --- Parsers ---
+INSERT_PREFIX = b'INSERT INTO public.deezer_track VALUES'
+
+# Scans a whole segment for INSERT lines in one finditer() pass; everything
+# else is skipped inside the regex engine. Each match spans one full line. The
+# optional group is the targeted matcher for the deezer_track layout: it
+# captures the track ID (field 0) and the quoted ISRC (field 5), skipping
+# fields 1-4 without splitting them. When it does not apply the groups are
+# None and the line goes to the full parser. No part may cross a newline.
+_LINE_RE = re.compile(
+    rb"^" + re.escape(INSERT_PREFIX) +
+    rb"(?: \((\d+),[^\S\n]*(?:(?:'(?:[^'\n]|'')*'|[^,'\n]*),[^\S\n]*){4}'([^'\n]+)'[^\S\n]*[,)])?"
+    rb"[^\n]*",
+    re.MULTILINE
+)
+
+# COPY ... (FORMAT BINARY) framing: signature, flags and header-extension
+# length up front, a field count of -1 at the end. Each row is a field count
+# followed by length-prefixed values: the ISRC as text, the track ID as int8.
+COPY_BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+COPY_BINARY_TRAILER = struct.pack('>h', -1)
+_ROW_STRUCTS = {}
+
+def _row_struct(isrc_len):
+    """Whole-row layout for an ISRC of the given length (almost always 12)."""
+    row = _ROW_STRUCTS.get(isrc_len)
+    if row is None:
+        row = _ROW_STRUCTS[isrc_len] = struct.Struct(f'>hi{isrc_len}siq')
+    return row
+
+class CopyBuffer:
+    """One COPY BINARY batch packed into a bytearray.
+
+    Rows are written in place at a cursor; reset() only rewinds it, so the
+    allocation is reused for every batch instead of being rebuilt.
+    """
+
+    def __init__(self, capacity=1024 * 1024):
+        self.data = bytearray(max(capacity, len(COPY_BINARY_HEADER) + len(COPY_BINARY_TRAILER)))
+        self.data[:len(COPY_BINARY_HEADER)] = COPY_BINARY_HEADER
+        self.reset()
+
+    def reset(self):
+        self.used = len(COPY_BINARY_HEADER)
+        self.rows = 0
+
+    def add_row(self, isrc, track_id):
+        isrc_len = len(isrc)
+        row = _row_struct(isrc_len)
+        start = self.used
+        end = start + row.size
+        data = self.data
+        # Always leave room for the trailer
+        if end + len(COPY_BINARY_TRAILER) > len(data):
+            data.extend(bytes(max(end, len(data))))
+        # One pack_into per row. The cursor only moves once it succeeds, so a
+        # track ID that fails to pack leaves the batch intact
+        row.pack_into(data, start, 2, isrc_len, isrc, 8, track_id)
+        self.used = end
+        self.rows += 1
+
+    def getbuffer(self):
+        """Returns a view of the complete stream, trailer included."""
+        end = self.used + len(COPY_BINARY_TRAILER)
+        self.data[self.used:end] = COPY_BINARY_TRAILER
+        return memoryview(self.data)[:end]
+
+class BufferReader:
+    """Read-only file interface over a memoryview, so copy_expert can stream
+    a batch without it being copied into a BytesIO first."""
+
+    def __init__(self, view):
+        self._view = view
+        self._pos = 0
+
+    def read(self, size=-1):
+        start = self._pos
+        end = len(self._view) if size < 0 else min(start + size, len(self._view))
+        self._pos = end
+        return self._view[start:end].tobytes()
+
+# A field separator is any comma outside a single-quoted string. Quoted strings
+# (with '' escapes) are consumed whole, so only top-level commas are matched.
+_TOKEN_RE = re.compile(rb"'(?:[^']|'')*'|,")
 
-# --- Robust Parser ---
 def parse_pg_dump_values(data_string):
+    # Fast path: the leading fields contain no quoted commas, so a plain split
+    # is exact. A quoted string cut by the split leaves an odd quote count.
+    head = data_string.split(b',', 6)
+    if all(field.count(b"'") % 2 == 0 for field in head[:6]):
+        return [field.strip() for field in head]
+
     fields = []
-    in_quotes = False
-    current_field = []
-    i = 0
-    while i < len(data_string):
-        char = data_string[i]
-        if char == "'":
-            if i + 1 < len(data_string) and data_string[i+1] == "'":
-                current_field.append("''")
-                i += 1
-            else:
-                in_quotes = not in_quotes
-                current_field.append("'")
-        elif char == ',' and not in_quotes:
-            fields.append("".join(current_field).strip())
-            current_field = []
-        else:
-            current_field.append(char)
-        i += 1
-    fields.append("".join(current_field).strip())
+    start = 0
+    for token in _TOKEN_RE.finditer(data_string):
+        if token.group() == b',':
+            fields.append(data_string[start:token.start()].strip())
+            start = token.end()
+    fields.append(data_string[start:].strip())
     return fields
 
 # --- Script ---
@@ -135,127 +247,197 @@ def setup_database(conn):
                 track_id BIGINT NOT NULL
             );
         """)
-        cur.execute(f"DROP TABLE IF EXISTS {QUALIFIED_TEMP_TABLE_NAME};")
-        cur.execute(f"""
-            CREATE UNLOGGED TABLE {QUALIFIED_TEMP_TABLE_NAME} (
-                isrc TEXT,
-                track_id BIGINT
-            );
-        """)
         conn.commit()
         print("Database setup complete.")
 
 def read_progress():
+    """Returns the set of (start, end) byte ranges that were fully loaded."""
     if not os.path.exists(PROGRESS_FILE):
-        return 0
+        return set()
+    done = set()
     try:
         with open(PROGRESS_FILE, 'r') as f:
-            content = f.read().strip()
-            return int(content) if content else 0
+            for row in f:
+                parts = row.split()
+                if len(parts) == 2:
+                    done.add((int(parts[0]), int(parts[1])))
     except (IOError, ValueError):
-        return 0
-
-def save_progress(line_num):
-    with open(PROGRESS_FILE, 'w') as f:
-        f.write(str(line_num))
-
-def flush_buffer_to_db(conn, buffer, rows_in_buffer):
-    if rows_in_buffer == 0:
+        return set()
+    return done
+
+def save_progress(start, end):
+    with open(PROGRESS_FILE, 'a') as f:
+        f.write(f"{start} {end}\n")
+
+def split_segments(mm):
+    """Cuts the file into ~SEGMENT_BYTES ranges that start and end on line boundaries."""
+    size = len(mm)
+    segments = []
+    start = 0
+    while start < size:
+        nl = mm.find(b'\n', min(start + SEGMENT_BYTES, size) - 1)
+        end = size if nl == -1 else nl + 1
+        segments.append((start, end))
+        start = end
+    return segments
+
+def flush_buffer_to_db(conn, buffer):
+    if buffer.rows == 0:
         return 0
     inserted_count = 0
     with conn.cursor() as cur:
-        buffer.seek(0)
-        cur.copy_expert(
-            f"COPY {QUALIFIED_TEMP_TABLE_NAME}(isrc, track_id) FROM STDIN",
-            buffer
-        )
+        cur.execute(f"""
+            CREATE TEMPORARY TABLE {TEMP_TABLE_NAME} (
+                isrc TEXT,
+                track_id BIGINT
+            ) ON COMMIT DROP;
+        """)
+        with buffer.getbuffer() as view:
+            cur.copy_expert(
+                f"COPY {TEMP_TABLE_NAME}(isrc, track_id) FROM STDIN WITH (FORMAT BINARY)",
+                BufferReader(view),
+                size=COPY_CHUNK_SIZE
+            )
+        # Inserting in key order makes concurrent workers take row locks in the
+        # same order, so overlapping batches wait on each other instead of
+        # deadlocking.
         cur.execute(f"""
             INSERT INTO {QUALIFIED_TABLE_NAME} (isrc, track_id)
-            SELECT isrc, track_id FROM {QUALIFIED_TEMP_TABLE_NAME}
+            SELECT isrc, track_id FROM {TEMP_TABLE_NAME}
+            ORDER BY isrc
             ON CONFLICT (isrc) DO NOTHING;
         """)
         inserted_count = cur.rowcount
-        cur.execute(f"TRUNCATE TABLE {QUALIFIED_TEMP_TABLE_NAME};")
         conn.commit()
     return inserted_count
 
-def process_sql_dump(conn):
-    start_line = read_progress()
-    print("-" * 50)
-    if start_line > 0:
-        print(f"Resuming process from line {start_line + 1:,}.")
-    else:
-        print(f"Starting new process from the beginning.")
-    print(f"Errors will be logged to '{ERROR_LOG_FILE}'.")
-    print("-" * 50)
+# --- Worker ---
+# Each pool process keeps its own connection, mapping of the dump, error log
+# handle and COPY buffers for its whole lifetime. Batches are double-buffered:
+# one is sent to the server on a background thread (psycopg2 releases the GIL
+# while it waits on the network) while the next one is being parsed.
 
-    start_time = time.time()
-    total_rows_inserted = 0
-    lines_processed_session = 0
-    buffer = io.StringIO()
-    rows_in_buffer = 0
+_worker = {}
+
+def init_worker():
+    # Ctrl+C is handled by the parent, which terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    conn = get_db_connection()
+    with conn.cursor() as cur:
+        for name, value in SESSION_SETTINGS.items():
+            cur.execute(f"SET {name} = %s;", (value,))
+    conn.commit()
+    f_in = open(SQL_FILE_PATH, 'rb')
+    _worker['conn'] = conn
+    _worker['mm'] = mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ)
+    _worker['f_err'] = open(ERROR_LOG_FILE, 'a', buffering=1)
+    # Sized so a full batch never has to grow the buffer
+    _worker['buffers'] = (CopyBuffer(FLUSH_BYTES + 64 * 1024), CopyBuffer(FLUSH_BYTES + 64 * 1024))
+    _worker['flusher'] = ThreadPoolExecutor(max_workers=1)
+
+def process_segment(segment):
+    """Parses and loads one byte range; returns (start, end, lines, rows_inserted)."""
+    start, end = segment
+    conn = _worker['conn']
+    mm = _worker['mm']
+    f_err = _worker['f_err']
+    flusher = _worker['flusher']
+    buffer, spare = _worker['buffers']
+    in_flight = None
+
+    rows_inserted = 0
+    lines_processed = 0
 
     try:
-        with open(SQL_FILE_PATH, 'r', encoding='latin-1', errors='ignore') as f_in, \
-             open(ERROR_LOG_FILE, 'a') as f_err:
-            if start_line > 0:
-                print("Fast-forwarding to resume point...")
-                for _ in range(start_line):
-                    next(f_in)
-                print("Resumed.")
-            
-            for line_num, line in enumerate(f_in, start=start_line + 1):
-                if not line.startswith('INSERT INTO public.deezer_track VALUES'):
-                    continue
-
-                try:
-                    data_part = line[line.find('(') + 1 : line.rfind(')')]
+        for match in _LINE_RE.finditer(mm, start, end):
+            try:
+                track_id, isrc = match.group(1, 2)
+                if track_id is None:
+                    # Unusual row (escaped strings, NULLs, ...): full parse
+                    line = match.group()
+                    data_part = line[line.find(b'(') + 1 : line.rfind(b')')]
                     values = parse_pg_dump_values(data_part)
-                    
+
                     if len(values) < 6:
                         raise ValueError(f"Line has only {len(values)} fields after parsing.")
 
                     track_id = values[0]
                     isrc_raw = values[5]
-                    isrc = isrc_raw.strip("'")
-                    
-                    if isrc:
-                        buffer.write(f"{isrc}\t{track_id}\n")
-                        rows_in_buffer += 1
-                    else:
-                        raise ValueError("ISRC is an empty string.")
-
-                except (IndexError, ValueError) as e:
-                    f_err.write(f"Line {line_num}: {e} - {line.strip()}\n")
-                    continue
-
-                if rows_in_buffer >= BATCH_SIZE:
-                    inserted = flush_buffer_to_db(conn, buffer, rows_in_buffer)
-                    total_rows_inserted += inserted
-                    save_progress(line_num)
-                    buffer.close()
-                    buffer = io.StringIO()
-                    rows_in_buffer = 0
-
-                lines_processed_session += 1
-                if lines_processed_session % PROGRESS_INTERVAL == 0:
-                    elapsed = time.time() - start_time
-                    rate = lines_processed_session / elapsed if elapsed > 0 else 0
-                    print(
-                        f"At line {line_num:,} | "
-                        f"Rows inserted this session: {total_rows_inserted:,} | "
-                        f"Rate: {rate:,.0f} lines/sec",
-                        end='\r'
-                    )
-
-            if rows_in_buffer > 0:
-                print("\nFlushing final batch...")
-                inserted = flush_buffer_to_db(conn, buffer, rows_in_buffer)
-                total_rows_inserted += inserted
-                save_progress(line_num)
-
+                    isrc = isrc_raw.strip(b"'")
+
+                if isrc:
+                    if not isrc.isascii():
+                        # The dump is latin-1; COPY expects UTF-8
+                        isrc = isrc.decode('latin-1').encode()
+                    buffer.add_row(isrc, int(track_id))
+                else:
+                    raise ValueError("ISRC is an empty string.")
+
+            except (IndexError, ValueError, struct.error) as e:
+                line = match.group()
+                f_err.write(f"Byte {match.start()}: {e} - {line.strip().decode('latin-1')}\n")
+                continue
+
+            lines_processed += 1
+            if buffer.used >= FLUSH_BYTES:
+                # Only one batch in flight: the spare is free once it lands
+                if in_flight is not None:
+                    rows_inserted += in_flight.result()
+                    spare.reset()
+                in_flight = flusher.submit(flush_buffer_to_db, conn, buffer)
+                buffer, spare = spare, buffer
+
+        if in_flight is not None:
+            rows_inserted += in_flight.result()
+            in_flight = None
+        rows_inserted += flush_buffer_to_db(conn, buffer)
     finally:
-        buffer.close()
+        # Never hand the connection back with a COPY still running
+        if in_flight is not None:
+            wait([in_flight])
+        buffer.reset()
+        spare.reset()
+
+    return start, end, lines_processed, rows_inserted
+
+def process_sql_dump():
+    with open(SQL_FILE_PATH, 'rb') as f_in, \
+         mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        size = len(mm)
+        segments = split_segments(mm)
+
+    done = read_progress()
+    pending = [seg for seg in segments if seg not in done]
+    bytes_done = sum(end - start for start, end in segments if (start, end) in done)
+
+    print("-" * 50)
+    if bytes_done > 0:
+        print(f"Resuming: {len(segments) - len(pending):,} of {len(segments):,} segments already loaded.")
+    else:
+        print(f"Starting new process from the beginning.")
+    print(f"Loading {len(pending):,} segments with {NUM_WORKERS} workers.")
+    print(f"Errors will be logged to '{ERROR_LOG_FILE}'.")
+    print("-" * 50)
+
+    start_time = time.time()
+    total_rows_inserted = 0
+    lines_processed_session = 0
+
+    with multiprocessing.Pool(NUM_WORKERS, initializer=init_worker) as pool:
+        for start, end, lines, inserted in pool.imap_unordered(process_segment, pending):
+            save_progress(start, end)
+            total_rows_inserted += inserted
+            lines_processed_session += lines
+            bytes_done += end - start
+
+            elapsed = time.time() - start_time
+            rate = lines_processed_session / elapsed if elapsed > 0 else 0
+            print(
+                f"{bytes_done / size:.1%} of file | "
+                f"Rows inserted this session: {total_rows_inserted:,} | "
+                f"Rate: {rate:,.0f} lines/sec",
+                end='\r'
+            )
 
     end_time = time.time()
     print("\n" + "=" * 50)
@@ -269,7 +451,7 @@ if __name__ == '__main__':
     try:
         conn = get_db_connection()
         setup_database(conn)
-        process_sql_dump(conn)
+        process_sql_dump()
     except KeyboardInterrupt:
         print("\n\nProcess interrupted by user. Progress has been saved. Exiting gracefully.")
         sys.exit(0)
@@ -279,4 +461,4 @@ if __name__ == '__main__':
     finally:
         if conn:
             conn.close()
-            print("Database connection closed.")
\ No newline at end of file
+            print("Database connection closed.")
@@ -8,7 +8,8 @@ flat text files in the current working directory:
     preview or are otherwise unusable.
 - processed_deezer_ids
     Deezer IDs that have already been checked so subsequent runs can resume
-    quickly.
+    quickly. IDs are appended as they are checked and the file is rewritten
+    sorted once the run ends.
 
 The script queries Deezer's public API endpoint:
 
@@ -18,7 +19,9 @@ For each ID, it decides whether to exclude it based on the API response:
 
 - If the response contains an "error":
     - "DataException" is treated as a permanent failure => exclude.
-    - Other errors are queued for a single retry pass.
+    - Rate-limit errors are retried with exponential backoff; IDs that still
+      fail (or fail for other reasons) are left unprocessed so that the next
+      run checks them again.
 - If there is no error but the track has no "preview" URL => exclude.
 
 Modes
@@ -34,11 +37,16 @@ Recheck mode (RECHECK_EXCLUDED = True)
 Optional downloads
 ------------------
 
-If DOWNLOAD_TRACKS is enabled, the script additionally writes a flat cache of
-API responses and preview MP3s into DOWNLOAD_LOCATION:
+If DOWNLOAD_TRACKS is enabled, the script additionally writes a cache of API
+responses and preview MP3s into DOWNLOAD_LOCATION, sharded by NNN, the last
+three digits of the ID, to keep directories small:
 
-- <DOWNLOAD_LOCATION>/<id>.json   (full Deezer API response)
-- <DOWNLOAD_LOCATION>/<id>.mp3    (preview audio, if available)
+- <DOWNLOAD_LOCATION>/<NNN>/<id>.json   (full Deezer API response)
+- <DOWNLOAD_LOCATION>/<NNN>/<id>.mp3    (preview audio, if available)
+
+Earlier versions wrote these files flat into DOWNLOAD_LOCATION. Such files are
+moved into their shards once at start-up, so an existing cache is reused rather
+than downloaded again.
 
 These downloads are best-effort: failures to write JSON or download MP3 will be
 printed but will not change the exclude/processed decision.
@@ -48,120 +56,347 @@ Notes
 
 - Paths are relative to the process working directory. This script is typically
     run from the data/ folder so that ../static/lisztnup.json resolves correctly.
-- CONCURRENCY controls in-flight requests; API_THROTTLE_SECONDS adds an
-    additional delay per request to reduce rate-limit pressure.
+- In-flight API requests are capped by an adaptive (AIMD) limit between 1 and
+    MAX_CONCURRENCY: it grows while responses are clean and halves when
+    Deezer reports a rate limit (error codes 4 and 700), at most once per
+    burst, after which the request is retried.
 """
 
 import json
 import os
+from collections import Counter
+from collections.abc import Iterator
 from pathlib import Path
+import random
 import asyncio
 import aiohttp
 from tqdm.asyncio import tqdm
 
+try:
+    import orjson  # Optional, faster JSON parsing/serialisation
+except ImportError:
+    orjson = None
+
+try:
+    import uvloop  # Optional, faster event loop (not available on Windows)
+except ImportError:
+    uvloop = None
+
+_json_loads = orjson.loads if orjson else json.loads
 
 
 # Toggle: Set to True to recheck previously excluded IDs and remove them if they now have previews
 RECHECK_EXCLUDED = False
 
-# Network tuning
-CONCURRENCY = 10          # Max concurrent HTTP requests
-API_THROTTLE_SECONDS = 1  # Sleep after each Deezer API call
+# Toggle: Set to True to print a line for every excluded, removed or failing ID
+VERBOSE = False
 
-# Optional: download Deezer JSON + preview MP3 to a flat folder
+# Network tuning
+INITIAL_CONCURRENCY = 4       # Concurrent API requests at start-up
+MAX_CONCURRENCY = 64          # Upper bound for the adaptive limit
+RATE_LIMIT_CODES = (4, 700)   # Deezer "quota exceeded" / "service busy"
+RATE_LIMIT_RETRIES = 5        # Retries per ID after a rate-limit response
+RETRY_BASE_SECONDS = 0.5      # Backoff base: up to base * 2**attempt, jittered
+MAX_BACKOFF_SECONDS = RETRY_BASE_SECONDS * 2 ** (RATE_LIMIT_RETRIES - 1)  # Longest backoff; also caps Retry-After
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=30, connect=10)
+
+# Optional: download Deezer JSON + preview MP3 to a sharded folder
 DOWNLOAD_TRACKS = True
-DOWNLOAD_LOCATION = Path("downloads")  # e.g. downloads/123213.json and downloads/123213.mp3
+DOWNLOAD_LOCATION = Path("downloads")  # e.g. downloads/213/123213.json and downloads/213/123213.mp3
+DOWNLOAD_CHUNK_BYTES = 64 * 1024       # Preview MP3s are streamed to disk in chunks of this size
+
+
+class RateLimitError(Exception):
+    """
+    Deezer answered with a rate-limit error; `response` holds the body and
+    `retry_after` the server's Retry-After hint in seconds, if it sent one.
+    """
+
+    def __init__(self, response: dict, retry_after: float | None = None) -> None:
+        super().__init__(response.get("error", {}).get("message", "rate limited"))
+        self.response = response
+        self.retry_after = retry_after
+
+
+def _parse_retry_after(value: str | None) -> float | None:
+    """
+    Parse a Retry-After header given in seconds, capped at MAX_BACKOFF_SECONDS;
+    HTTP dates are ignored.
+    """
+    try:
+        seconds = max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+    if seconds > MAX_BACKOFF_SECONDS:
+        _log(f"Retry-After of {value} seconds capped at {MAX_BACKOFF_SECONDS:g} seconds")
+        return MAX_BACKOFF_SECONDS
+    return seconds
+
+
+class AdaptiveLimiter:
+    """
+    Async context manager capping in-flight requests with an AIMD window.
+
+    Like TCP congestion control, the limit grows by one after a window's worth
+    of clean responses and is halved on a rate-limit response, at most once
+    per window: rate limits usually arrive in bursts, so responses to requests
+    sent before the last decrease (an older `epoch`) do not halve it again.
+    """
+
+    def __init__(self, initial: int, maximum: int) -> None:
+        self.limit = initial
+        self.maximum = maximum
+        self._in_flight = 0
+        self._clean = 0
+        self.epoch = 0  # Number of decreases so far
+        self._slots = asyncio.Condition()
+
+    async def __aenter__(self) -> "AdaptiveLimiter":
+        async with self._slots:
+            await self._slots.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        async with self._slots:
+            self._in_flight -= 1
+            if self._in_flight < self.limit:
+                self._slots.notify(self.limit - self._in_flight)
+
+    def succeeded(self) -> None:
+        """Additive increase: one more slot per window of clean responses."""
+        self._clean += 1
+        if self._clean >= self.limit and self.limit < self.maximum:
+            self.limit += 1
+            self._clean = 0
+
+    def overloaded(self, epoch: int) -> None:
+        """
+        Multiplicative decrease on a rate-limit response to a request sent
+        during `epoch`; ignored if the limit was already cut since then.
+        """
+        if epoch != self.epoch:
+            return
+        self.limit = max(1, self.limit // 2)
+        self._clean = 0
+        self.epoch += 1
+
+
+def _log(message: str) -> None:
+    """Print a per-ID message above the progress bar, only when VERBOSE."""
+    if VERBOSE:
+        tqdm.write(message)
 
 
 def _ensure_download_location() -> None:
     if DOWNLOAD_TRACKS:
         DOWNLOAD_LOCATION.mkdir(parents=True, exist_ok=True)
+        _migrate_flat_downloads()
+
+
+_created_shards: set[Path] = set()
 
 
-def _write_json_flat(deezer_id: int, payload: dict) -> None:
-    """Write Deezer response JSON to <DOWNLOAD_LOCATION>/<id>.json (flat)."""
-    out_path = DOWNLOAD_LOCATION / f"{deezer_id}.json"
-    out_path.write_text(json.dumps(payload, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+def _download_path(deezer_id: int, suffix: str) -> Path:
+    """Return <DOWNLOAD_LOCATION>/<NNN>/<id><suffix>, creating the shard once."""
+    shard = DOWNLOAD_LOCATION / f"{deezer_id % 1000:03d}"
+    if shard not in _created_shards:
+        shard.mkdir(exist_ok=True)
+        _created_shards.add(shard)
+    return shard / f"{deezer_id}{suffix}"
+
+
+def _migrate_flat_downloads() -> None:
+    """
+    Move <id>.json / <id>.mp3 files left flat in DOWNLOAD_LOCATION by earlier
+    versions into their shards, in one pass at start-up. A file whose shard
+    already holds a copy is left where it is.
+    """
+    moved = 0
+    with os.scandir(DOWNLOAD_LOCATION) as entries:
+        for entry in entries:
+            stem, dot, suffix = entry.name.partition(".")
+            if not (dot and suffix in ("json", "mp3") and stem.isdigit() and entry.is_file()):
+                continue
+            path = _download_path(int(stem), f".{suffix}")
+            if not path.exists():
+                Path(entry.path).replace(path)
+                moved += 1
+    if moved:
+        print(f"Moved {moved} downloaded files into the sharded layout.")
+
+
+def _write_json(deezer_id: int, payload: dict) -> None:
+    """Write Deezer response JSON to its shard in DOWNLOAD_LOCATION."""
+    out_path = _download_path(deezer_id, ".json")
+    if orjson:
+        out_path.write_bytes(orjson.dumps(payload, option=orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE))
+    else:
+        out_path.write_text(json.dumps(payload, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+
+
+def _read_cached_json(deezer_id: int) -> dict | None:
+    """
+    Return the cached API response for deezer_id, or None if there is none.
+
+    Cached errors other than DataException (rate limits, network failures)
+    are transient and ignored, so those IDs are queried again.
+    """
+    try:
+        res = _json_loads(_download_path(deezer_id, ".json").read_bytes())
+    except (OSError, ValueError):
+        return None
+    error = res.get("error")
+    if error and error.get("type") != "DataException":
+        return None
+    return res
 
 
 async def _download_preview_mp3(session: aiohttp.ClientSession, deezer_id: int, preview_url: str) -> None:
-    """Download preview MP3 to <DOWNLOAD_LOCATION>/<id>.mp3 (flat)."""
-    out_path = DOWNLOAD_LOCATION / f"{deezer_id}.mp3"
+    """Download preview MP3 to its shard in DOWNLOAD_LOCATION."""
+    out_path = _download_path(deezer_id, ".mp3")
     if out_path.exists() and out_path.stat().st_size > 0:
         return
 
+    # Stream to a temporary name so an interrupted download is never taken
+    # for a complete file by the check above.
+    part_path = out_path.with_suffix(".mp3.part")
     async with session.get(preview_url) as resp:
         resp.raise_for_status()
-        out_path.write_bytes(await resp.read())
+        with part_path.open("wb") as f:
+            async for chunk in resp.content.iter_chunked(DOWNLOAD_CHUNK_BYTES):
+                f.write(chunk)
+            if hasattr(os, "posix_fadvise"):
+                # Previews are written once and not read back here: start
+                # writeback and let the kernel drop them from the page cache.
+                f.flush()
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    part_path.replace(out_path)
+
+
+async def _get_track(
+    limiter: AdaptiveLimiter,
+    session: aiohttp.ClientSession,
+    deezer_id: int,
+) -> dict:
+    """Query the Deezer track API within a limiter slot, reporting the outcome."""
+    async with limiter:
+        epoch = limiter.epoch
+        async with session.get(f"https://api.deezer.com/track/{deezer_id}") as resp:
+            # Parse the raw body directly; skips aiohttp's decode to str
+            res = _json_loads(await resp.read())
+            retry_after = resp.headers.get("Retry-After")
+
+        # Check for quota or service busy
+        error = res.get("error")
+        if error and error.get("code") in RATE_LIMIT_CODES:
+            limiter.overloaded(epoch)
+            raise RateLimitError(res, _parse_retry_after(retry_after))
+        limiter.succeeded()
+        return res
+
+
+async def _query_track(
+    limiter: AdaptiveLimiter,
+    session: aiohttp.ClientSession,
+    deezer_id: int,
+) -> dict:
+    """
+    Query the Deezer API for one track.
+
+    Rate-limited requests are retried up to RATE_LIMIT_RETRIES times, waiting
+    as long as the Retry-After header asks or, without one, using full-jitter
+    exponential backoff; if the last attempt is still rate limited, its error
+    response is returned.
+    """
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        try:
+            return await _get_track(limiter, session, deezer_id)
+        except RateLimitError as e:
+            res = e.response
+            if attempt < RATE_LIMIT_RETRIES:
+                delay = e.retry_after
+                if delay is None:
+                    delay = random.uniform(0, RETRY_BASE_SECONDS * 2 ** attempt)
+                _log(f"Rate limit hit for {deezer_id}, retrying in {delay:.1f} seconds...")
+                await asyncio.sleep(delay)
+    return res
 
 
 async def fetch_deezer(
-    semaphore: asyncio.Semaphore,
+    limiter: AdaptiveLimiter,
     session: aiohttp.ClientSession,
     deezer_id: int,
 ) -> tuple[int, dict]:
     """
-    Fetch Deezer track info asynchronously with concurrency limit.
+    Fetch Deezer track info asynchronously under the adaptive limit.
+
+    With DOWNLOAD_TRACKS, a response already in the download cache is reused
+    instead of querying the API again (except in recheck mode).
 
     Returns (deezer_id, response_dict).
     """
-    async with semaphore:
-        try:
-            async with session.get(f"https://api.deezer.com/track/{deezer_id}") as resp:
-                res = await resp.json()
-
-            # Check for quota or service busy
-            error = res.get("error")
-            if error and error.get("code") in [4, 700]:
-                print(f"Rate limit hit for {deezer_id}, sleeping 5 seconds...")
-                await asyncio.sleep(5)
+    try:
+        cached = _read_cached_json(deezer_id) if DOWNLOAD_TRACKS and not RECHECK_EXCLUDED else None
+        res = cached if cached is not None else await _query_track(limiter, session, deezer_id)
 
-            # Optional downloads
-            if DOWNLOAD_TRACKS:
+        # Optional downloads
+        if DOWNLOAD_TRACKS:
+            if cached is None:
                 try:
-                    _write_json_flat(deezer_id, res)
+                    _write_json(deezer_id, res)
                 except Exception as e:
-                    print(f"Failed to write JSON for {deezer_id}: {e}")
-
-                preview_url = res.get("preview")
-                if preview_url:
-                    try:
-                        await _download_preview_mp3(session, deezer_id, preview_url)
-                    except Exception as e:
-                        print(f"Failed to download MP3 for {deezer_id}: {e}")
-
-            await asyncio.sleep(API_THROTTLE_SECONDS)  # Throttle after each API call
-            return deezer_id, res
-        except Exception as e:
-            # Throttle even on exception
-            await asyncio.sleep(API_THROTTLE_SECONDS)
-            err_res = {"error": {"type": "Exception", "message": str(e), "code": 0}}
-            if DOWNLOAD_TRACKS:
+                    tqdm.write(f"Failed to write JSON for {deezer_id}: {e}")
+
+            preview_url = res.get("preview")
+            if preview_url:
                 try:
-                    _write_json_flat(deezer_id, err_res)
-                except Exception:
-                    pass
-            return deezer_id, err_res
+                    await _download_preview_mp3(session, deezer_id, preview_url)
+                except Exception as e:
+                    tqdm.write(f"Failed to download MP3 for {deezer_id}: {e}")
+
+        return deezer_id, res
+    except Exception as e:
+        err_res = {"error": {"type": "Exception", "message": str(e), "code": 0}}
+        if DOWNLOAD_TRACKS:
+            try:
+                _write_json(deezer_id, err_res)
+            except Exception:
+                pass
+        return deezer_id, err_res
+
+
+async def _check_worker(
+    pending_ids: Iterator[int],
+    limiter: AdaptiveLimiter,
+    session: aiohttp.ClientSession,
+    results: asyncio.Queue,
+) -> None:
+    """Fetch IDs from the shared iterator and queue the results until it is exhausted."""
+    for deezer_id in pending_ids:
+        await results.put(await fetch_deezer(limiter, session, deezer_id))
 
 
-def load_excluded() -> set[int]:
-    """Load excluded Deezer IDs from file, create empty file if not exists."""
-    path = Path("excluded_deezer_ids")
+def _load_id_file(path: Path) -> set[int]:
+    """Load one ID per line from path, create empty file if not exists."""
     if path.exists():
-        return set(int(line.strip()) for line in path.read_text().splitlines() if line.strip())
+        # Iterate the raw lines: int() accepts bytes and surrounding whitespace,
+        # so there is no decoded copy or intermediate list of the whole file.
+        with path.open("rb") as f:
+            return {int(line) for line in f if not line.isspace()}
     else:
         path.write_text("")
         return set()
 
 
+def load_excluded() -> set[int]:
+    """Load excluded Deezer IDs from file, create empty file if not exists."""
+    return _load_id_file(Path("excluded_deezer_ids"))
+
+
 def load_processed() -> set[int]:
     """Load processed Deezer IDs from file, create empty file if not exists."""
-    path = Path("processed_deezer_ids")
-    if path.exists():
-        return set(int(line.strip()) for line in path.read_text().splitlines() if line.strip())
-    else:
-        path.write_text("")
-        return set()
+    return _load_id_file(Path("processed_deezer_ids"))
 
 
 def save_processed(processed: set[int]) -> None:
@@ -169,6 +404,11 @@ def save_processed(processed: set[int]) -> None:
     Path("processed_deezer_ids").write_text("\n".join(map(str, sorted(processed))) + "\n")
 
 
+def save_excluded(excluded: set[int]) -> None:
+    """Save excluded Deezer IDs to file."""
+    Path("excluded_deezer_ids").write_text("\n".join(map(str, sorted(excluded))) + "\n")
+
+
 async def main() -> None:
     """
     Main function to check Deezer IDs for validity.
@@ -180,25 +420,23 @@ async def main() -> None:
     processed = load_processed()
     print(f"Loaded {len(excluded)} excluded and {len(processed)} processed Deezer IDs.")
 
-    # Load JSON data
-    json_path = Path("../static/lisztnup.json")
-    with json_path.open("r", encoding="utf-8") as f:
-        data = json.load(f)
-
     # Collect all Deezer IDs to check
-    ids_to_check = set()
-    
     if RECHECK_EXCLUDED:
         # Recheck mode: check all previously excluded IDs
         ids_to_check = excluded.copy()
         print(f"Recheck mode: will verify {len(ids_to_check)} previously excluded IDs.")
     else:
+        # Load JSON data (parsed from bytes, with orjson if available)
+        data = _json_loads(Path("../static/lisztnup.json").read_bytes())
+
         # Normal mode: check IDs not excluded or processed
-        for work in data["works"]:
-            for part in work["parts"]:
-                for deezer_id in part["deezer"]:
-                    if deezer_id not in excluded and deezer_id not in processed:
-                        ids_to_check.add(deezer_id)
+        all_ids = {
+            deezer_id
+            for work in data["works"]
+            for part in work["parts"]
+            for deezer_id in part["deezer"]
+        }
+        ids_to_check = all_ids - excluded - processed
 
     ids_list = list(ids_to_check)
     print(f"Found {len(ids_list)} Deezer IDs to check.")
@@ -207,106 +445,115 @@ async def main() -> None:
         print("No IDs to check. Exiting.")
         return
 
-    semaphore = asyncio.Semaphore(CONCURRENCY)
-    new_excluded = 0
+    limiter = AdaptiveLimiter(INITIAL_CONCURRENCY, MAX_CONCURRENCY)
+    exclude_reasons = Counter()  # Newly excluded IDs by reason
+    still_failing = 0  # IDs left for the next run
     removed_from_excluded = 0  # Track IDs removed from excluded list in recheck mode
-    retry_ids = set()
-
-    async with aiohttp.ClientSession() as session:
-        # Create tasks
-        tasks = [fetch_deezer(semaphore, session, did) for did in ids_list]
-
-        with tqdm(total=len(ids_list), desc="Checking IDs") as pbar:
-            for coro in asyncio.as_completed(tasks):
-                deezer_id, res = await coro
-                processed.add(deezer_id)
-                error = res.get("error")
-
-                if RECHECK_EXCLUDED:
-                    # Recheck mode: remove from excluded if preview is now available
-                    if not error and res.get("preview"):
-                        excluded.discard(deezer_id)
-                        removed_from_excluded += 1
-                        Path("excluded_deezer_ids").write_text("\n".join(map(str, sorted(excluded))) + "\n")
-                        print(f"Removed {deezer_id} from excluded (preview now available)")
-                    # If still no preview or error, keep it in excluded (do nothing)
-                else:
-                    # Normal mode: add to excluded if no preview or error
-                    if error:
-                        error_type = error.get("type")
-                        error_code = error.get("code", 0)
-                        if error_type == "DataException":
-                            # Treat as failure
+
+    # One session for the whole run; the connector keeps connections to both
+    # the API and the preview CDN alive between requests.
+    connector = aiohttp.TCPConnector(
+        limit=MAX_CONCURRENCY * 2,
+        limit_per_host=MAX_CONCURRENCY,
+        ttl_dns_cache=300,
+        keepalive_timeout=60,
+    )
+    # New exclusions are appended through one handle; recheck mode removes IDs
+    # instead, so it rewrites the file at checkpoints and on exit.
+    excluded_file = None if RECHECK_EXCLUDED else Path("excluded_deezer_ids").open("a", encoding="utf-8")
+    excluded_dirty = False
+    # processed_deezer_ids is a log while running: each checked ID is appended
+    # once, and the file is only sorted when the run ends
+    processed_file = Path("processed_deezer_ids").open("a", encoding="utf-8")
+    try:
+        async with (
+            aiohttp.ClientSession(connector=connector, timeout=REQUEST_TIMEOUT) as session,
+            asyncio.TaskGroup() as workers,
+        ):
+            # A fixed pool of workers shares one iterator over the IDs; the
+            # limiter decides how many of them may have a request in flight.
+            pending_ids = iter(ids_list)
+            results = asyncio.Queue(maxsize=MAX_CONCURRENCY)
+            for _ in range(min(MAX_CONCURRENCY, len(ids_list))):
+                workers.create_task(_check_worker(pending_ids, limiter, session, results))
+
+            with tqdm(total=len(ids_list), desc="Checking IDs") as pbar:
+                for completed in range(1, len(ids_list) + 1):
+                    deezer_id, res = await results.get()
+                    checked = True
+                    error = res.get("error")
+
+                    if RECHECK_EXCLUDED:
+                        # Recheck mode: remove from excluded if preview is now available
+                        if not error and res.get("preview"):
+                            excluded.discard(deezer_id)
+                            removed_from_excluded += 1
+                            excluded_dirty = True
+                            _log(f"Removed {deezer_id} from excluded (preview now available)")
+                        # If still no preview or error, keep it in excluded (do nothing)
+                    else:
+                        # Normal mode: add to excluded if no preview or error
+                        if error:
+                            error_type = error.get("type")
+                            error_code = error.get("code", 0)
+                            if error_type == "DataException":
+                                # Treat as failure
+                                excluded.add(deezer_id)
+                                excluded_file.write(f"{deezer_id}\n")
+                                exclude_reasons["DataException"] += 1
+                                _log(f"Excluded {deezer_id} (DataException)")
+                            else:
+                                # Transient failure: leave it for the next run
+                                checked = False
+                                still_failing += 1
+                                _log(f"Still failing: {deezer_id} (code {error_code}), will be checked again next run")
+                        elif not res.get("preview"):
+                            # No preview, exclude
                             excluded.add(deezer_id)
-                            with Path("excluded_deezer_ids").open("a", encoding="utf-8") as f:
-                                f.write(f"{deezer_id}\n")
-                            new_excluded += 1
-                            print(f"Excluded {deezer_id} (DataException)")
-                        else:
-                            retry_ids.add(deezer_id)
-                            print(f"Retrying later: {deezer_id} (code {error_code})")
-                    elif not res.get("preview"):
-                        # No preview, exclude
-                        excluded.add(deezer_id)
-                        with Path("excluded_deezer_ids").open("a", encoding="utf-8") as f:
-                            f.write(f"{deezer_id}\n")
-                        new_excluded += 1
-                        print(f"Excluded {deezer_id} (no preview)")
-
-                pbar.update(1)
-                if len(processed) % 100 == 0:
-                    save_processed(processed)
-
-    # Save progress
-    save_processed(processed)
+                            excluded_file.write(f"{deezer_id}\n")
+                            exclude_reasons["no preview"] += 1
+                            _log(f"Excluded {deezer_id} (no preview)")
+
+                    if checked and deezer_id not in processed:
+                        processed.add(deezer_id)
+                        processed_file.write(f"{deezer_id}\n")
+
+                    pbar.update(1)
+                    if completed % 100 == 0:
+                        # Exclusions first, so no processed ID is missing from them
+                        if excluded_file:
+                            excluded_file.flush()
+                        if excluded_dirty:
+                            save_excluded(excluded)
+                            excluded_dirty = False
+                        processed_file.flush()
+    finally:
+        # Save progress, also when interrupted
+        if excluded_file:
+            excluded_file.close()
+        if excluded_dirty:
+            save_excluded(excluded)
+        processed_file.close()
+        save_processed(processed)
     
     if RECHECK_EXCLUDED:
         print(f"Recheck complete. Removed {removed_from_excluded} IDs from excluded list. Total excluded: {len(excluded)}")
     else:
         # Normal mode
-        print(f"Progress saved. Newly excluded: {new_excluded}, Total excluded: {len(excluded)}")
-
-    # Handle retries
-    if retry_ids:
-        print(f"Retrying {len(retry_ids)} IDs...")
-        # Add back to ids_list and process once more
-        retry_list = list(retry_ids - processed)  # Avoid duplicates
-        if retry_list:
-            async with aiohttp.ClientSession() as session:
-                retry_tasks = [fetch_deezer(semaphore, session, did) for did in retry_list]
-                for coro in asyncio.as_completed(retry_tasks):
-                    deezer_id, res = await coro
-                    processed.add(deezer_id)
-                    error = res.get("error")
-                    if error:
-                        error_type = error.get("type")
-                        if error_type == "DataException":
-                            excluded.add(deezer_id)
-                            with Path("excluded_deezer_ids").open("a", encoding="utf-8") as f:
-                                f.write(f"{deezer_id}\n")
-                            new_excluded += 1
-                            print(f"Excluded {deezer_id} (DataException on retry)")
-                        else:
-                            # Still error, exclude
-                            excluded.add(deezer_id)
-                            with Path("excluded_deezer_ids").open("a", encoding="utf-8") as f:
-                                f.write(f"{deezer_id}\n")
-                            new_excluded += 1
-                            print(f"Excluded {deezer_id} (error on retry: {error_type})")
-                    elif not res.get("preview"):
-                        excluded.add(deezer_id)
-                        with Path("excluded_deezer_ids").open("a", encoding="utf-8") as f:
-                            f.write(f"{deezer_id}\n")
-                        new_excluded += 1
-                        print(f"Excluded {deezer_id} (no preview on retry)")
-
-                if len(processed) % 100 == 0:
-                    save_processed(processed)
-                save_processed(processed)
-                print(f"Retry complete. Total newly excluded: {new_excluded}")
+        reasons = ", ".join(f"{reason}: {count}" for reason, count in exclude_reasons.most_common())
+        print(
+            f"Progress saved. Newly excluded: {exclude_reasons.total()}"
+            + (f" ({reasons})" if reasons else "")
+            + f", Total excluded: {len(excluded)}"
+        )
+        if still_failing:
+            print(f"{still_failing} IDs still failing, they will be checked again next run.")
 
     print("Done.")
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if uvloop:
+        uvloop.run(main())
+    else:
+        asyncio.run(main())
\ No newline at end of file
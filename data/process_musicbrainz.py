@@ -28,13 +28,18 @@ This script executes a multi-stage data processing pipeline:
 13. Prints a summary of the entire transformation process.
 """
 
+import heapq
 import json
 import math
 import re
 from collections import Counter, defaultdict
 from dataclasses import dataclass
+from functools import cached_property, lru_cache
+from itertools import chain
+from json.encoder import encode_basestring_ascii
+from operator import attrgetter, itemgetter
 from pathlib import Path
-from typing import Dict, List, Optional, Set, Any, Tuple
+from typing import Callable, Dict, FrozenSet, List, Optional, Any, Tuple
 import yaml
 
 # ==============================================================================
@@ -76,13 +81,20 @@ TYPE_MAPPING = {
     "Sonata": "other", "Partita": "other"
 }
 
+# Patterns containing none of these are plain keywords
+REGEX_METACHARS = frozenset("\\.^$*+?{}[]|()")
+
+# Typographic quotes in work names are matched as their ASCII equivalents.
+QUOTE_NORMALIZATION = str.maketrans({"’": "'", "“": '"', "”": '"'})
+
 # --- Recording Selection Preferences ---
 LABEL_PREFERENCE = [
     "Deutsche Grammophon", "EMI", "Decca", "Hyperion", "Chandos", "Universal", "Philips"
 ]
+LABEL_RANK: Dict[str, int] = {label.lower(): rank for rank, label in enumerate(LABEL_PREFERENCE)}
 
 # --- Excluded Composers ---
-EXCLUDED_COMPOSERS: Set[str] = set([
+EXCLUDED_COMPOSERS: FrozenSet[str] = frozenset([
     "Gruber, Franz Xaver",
     "Pierpont, James Lord",
     "Foster, Stephen",
@@ -113,9 +125,9 @@ EXCLUDED_COMPOSERS: Set[str] = set([
 ])
 
 # Deezer IDs without preview mp3s, loaded from 'excluded_deezer_ids' file
-EXCLUDED_DEEZER_IDS: Set[int] = set([])
+EXCLUDED_DEEZER_IDS: FrozenSet[int] = frozenset()
 
-EXCLUDED_WORKS: Set[str] = set([
+EXCLUDED_WORKS: FrozenSet[str] = frozenset([
     "bf57c435-6ce0-3d57-ab04-e2a9179b178c", # O Holy Night
     "0e587c69-8ec2-3c66-ae73-c7ed79956af7", # O Holy Night
     "681428fa-9095-388d-9500-ad88c7837f0c", # O Holy Night
@@ -145,7 +157,9 @@ WSS_OVERRIDES: Dict[str, float] = {
 
 
 # --- Input Data Classes (matching 'musicbrainz.json') ---
-@dataclass
+# Slotted: there is one instance per recording and work in the input, so the
+# per-instance __dict__ would dominate memory.
+@dataclass(slots=True)
 class MBRecording:
     """Represents a single recording from the Musicbrainz data."""
 
@@ -156,7 +170,7 @@ class MBRecording:
     deezerId: int
 
 
-@dataclass
+@dataclass(slots=True)
 class MBWork:
     """Represents a single work (which can have sub-works) from the Musicbrainz data."""
 
@@ -171,7 +185,7 @@ class MBWork:
     total_subworks_count: int = 0
 
 
-@dataclass
+@dataclass(slots=True)
 class MBComposer:
     """Represents a single composer and their top-level works from the Musicbrainz data."""
 
@@ -183,7 +197,7 @@ class MBComposer:
 
 
 # --- Output Data Classes (for 'lisztnup.json') ---
-@dataclass
+@dataclass(slots=True)
 class FinalPart:
     """Represents a single, curated part of a work in the final dataset."""
 
@@ -192,10 +206,10 @@ class FinalPart:
     score: float  # Relative score (0-100) compared to the work's most popular part.
 
     def to_dict(self) -> Dict[str, Any]:
-        return self.__dict__
+        return {"name": self.name, "deezer": self.deezer, "score": self.score}
 
 
-@dataclass
+@dataclass(slots=True)
 class FinalWork:
     """Represents a single, curated root work in the final dataset."""
 
@@ -209,10 +223,19 @@ class FinalWork:
     parts: List[FinalPart]
 
     def to_dict(self) -> Dict[str, Any]:
-        return {**self.__dict__, "parts": [p.to_dict() for p in self.parts]}
+        return {
+            "gid": self.gid,
+            "composer": self.composer,
+            "name": self.name,
+            "type": self.type,
+            "begin_year": self.begin_year,
+            "end_year": self.end_year,
+            "score": self.score,
+            "parts": [p.to_dict() for p in self.parts],
+        }
 
 
-@dataclass
+@dataclass(slots=True)
 class FinalComposer:
     """Represents a composer present in the final dataset."""
 
@@ -223,7 +246,13 @@ class FinalComposer:
     score: float
 
     def to_dict(self) -> Dict[str, Any]:
-        return self.__dict__
+        return {
+            "gid": self.gid,
+            "name": self.name,
+            "birth_year": self.birth_year,
+            "death_year": self.death_year,
+            "score": self.score,
+        }
 
 
 @dataclass
@@ -233,12 +262,44 @@ class FinalOutput:
     composers: List[FinalComposer]
     works: List[FinalWork]
 
+    @cached_property
+    def composer_names(self) -> Dict[str, str]:
+        """Composer names by gid, shared by the log, summary and report."""
+        return {c.gid: c.name for c in self.composers}
+
+    @cached_property
+    def works_by_composer(self) -> Dict[str, List[FinalWork]]:
+        """Works by composer gid, in output order."""
+        grouped: Dict[str, List[FinalWork]] = defaultdict(list)
+        for work in self.works:
+            grouped[work.composer].append(work)
+        return grouped
+
     def to_dict(self) -> Dict[str, Any]:
         return {
             "composers": [c.to_dict() for c in self.composers],
             "works": [w.to_dict() for w in self.works],
         }
 
+    def write_json(self, write: Callable[[str], Any], indent: int = 2) -> None:
+        """
+        Writes the same JSON as write_compact_json(self.to_dict(), write, indent),
+        converting one composer or work at a time instead of the whole output.
+        """
+        pad = " " * indent
+        write("{")
+        for i, (key, items) in enumerate((("composers", self.composers), ("works", self.works))):
+            write(f'{"," if i else ""}\n{pad}"{key}": ')
+            if not items:
+                write("[]")
+                continue
+            write("[")
+            for j, item in enumerate(items):
+                write(f'{"," if j else ""}\n{pad * 2}')
+                write_compact_json(item.to_dict(), write, indent, 2)
+            write(f"\n{pad}]")
+        write("\n}")
+
 
 # ==============================================================================
 # --- Main Processing Class ---
@@ -263,8 +324,87 @@ class MusicbrainzProcessor:
             rules = yaml.safe_load(f)
         self.general_rules = rules.get("general_rules", {})
         self.composer_specific_rules = rules.get("composer_specific_rules", {})
+        # Compiled rules: general ones up front, composer-specific ones on first use
+        self.general_classifier = self._compile_rules(self.general_rules, "general")
+        self.composer_classifiers: Dict[str, List[Tuple[str, re.Pattern]]] = {}
+        # Rule matches by (composer with specific rules or None, normalized name);
+        # None marks a name no rule matched
+        self.rule_match_cache: Dict[Tuple[Optional[str], str], Optional[str]] = {}
         self.stats: Counter = Counter()
 
+    @staticmethod
+    def _compile_rules(rules: Dict[str, Any], owner: str) -> List[Tuple[str, re.Pattern]]:
+        """
+        Compiles a {rule_type: [pattern, ...]} mapping from the rules file.
+
+        The patterns of each rule type are fused into one case-insensitive
+        alternation, so a name is tested once per rule type instead of once per
+        pattern. Rule types keep their order; invalid entries are reported and
+        skipped.
+
+        :param rules: The rule types and their regex patterns, in priority order.
+        :param owner: "general" or the composer name, used in error messages.
+        :return: A list of (rule_type, compiled pattern) pairs.
+        """
+        compiled = []
+        for rule_type, patterns in rules.items():
+            if not isinstance(patterns, list):
+                print(f"Invalid patterns type for {owner} {rule_type}: {type(patterns)}")
+                continue
+            valid = []
+            for pattern in patterns:
+                if not isinstance(pattern, str):
+                    print(f"Invalid pattern type: {type(pattern)} for {pattern}")
+                    continue
+                try:
+                    re.compile(pattern)
+                except re.error as e:
+                    print(f"Error processing pattern: {e}, pattern: {pattern}")
+                    continue
+                valid.append(pattern)
+            # Plain keywords share one prefix trie instead of one branch each
+            literals = [p for p in valid if not REGEX_METACHARS.intersection(p)]
+            if len(literals) > 1:
+                branches = [MusicbrainzProcessor._literal_trie(literals)]
+                branches.extend(p for p in valid if REGEX_METACHARS.intersection(p))
+            else:
+                branches = valid
+            try:
+                fused = re.compile("|".join(f"(?:{p})" for p in branches), re.IGNORECASE)
+            except re.error:
+                # e.g. inline global flags, which are only allowed at the start
+                compiled.extend((rule_type, re.compile(p, re.IGNORECASE)) for p in valid)
+            else:
+                if valid:
+                    compiled.append((rule_type, fused))
+        return compiled
+
+    @staticmethod
+    def _literal_trie(words: List[str]) -> str:
+        """
+        Builds a regex matching exactly the given literal words, with shared
+        prefixes factored out, e.g. ["Suite", "Sonata", "Sonatina"] becomes
+        "S(?:onat(?:a|ina)|uite)".
+
+        :param words: Literal strings without regex metacharacters.
+        :return: An equivalent regex pattern.
+        """
+        trie: Dict[str, Any] = {}
+        for word in words:
+            node = trie
+            for char in word:
+                node = node.setdefault(char, {})
+            node[""] = {}
+
+        def emit(node: Dict[str, Any]) -> str:
+            branches = [re.escape(char) + emit(child) for char, child in sorted(node.items()) if char]
+            if not branches:
+                return ""
+            pattern = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+            return f"(?:{pattern})?" if "" in node else pattern
+
+        return emit(trie)
+
     def _parse_input_data(self, raw_data: List[Dict[str, Any]]) -> List[MBComposer]:
         """
         Parses the raw list of dictionaries into a list of MBComposer objects.
@@ -300,7 +440,11 @@ class MusicbrainzProcessor:
             self._parse_work_tree(sub, current_type)
             for sub in work_dict.get("subworks", [])
         ]
-        recordings = [MBRecording(**rec) for rec in work_dict.get("recordings", [])]
+        # Positional, in MBRecording field order; cheaper than **rec for every recording
+        recordings = [
+            MBRecording(rec["gid"], rec["name"], rec["isrc"], rec["label"], rec["deezerId"])
+            for rec in work_dict.get("recordings", [])
+        ]
         return MBWork(
             gid=work_dict["gid"],
             name=work_dict["name"],
@@ -329,7 +473,7 @@ class MusicbrainzProcessor:
         works_after_wss = self._filter_works_cleanup(works_after_wss)
 
         # Stage 3: Finalize the composer list based on who has works remaining
-        all_works_for_scores = [w for works in works_after_wss.values() for w in works]
+        all_works_for_scores = list(chain.from_iterable(works_after_wss.values()))
         final_composers = self._filter_final_composers(
             composers_by_birth_year, works_after_wss, all_works_for_scores
         )
@@ -345,11 +489,11 @@ class MusicbrainzProcessor:
             all_works.extend(synced_list)
 
         # Sort by composer name then work name
-        composer_map = {c.gid: c.name for c in final_composers}
+        final_output = FinalOutput(composers=final_composers, works=all_works)
+        composer_map = final_output.composer_names
         all_works.sort(key=lambda w: (composer_map.get(w.composer, ""), w.name))
 
         # Stage 5: Write logs and return the final packaged data
-        final_output = FinalOutput(composers=final_composers, works=all_works)
         self._write_unresolved_log(final_output)
         return final_output
 
@@ -363,12 +507,15 @@ class MusicbrainzProcessor:
         self.stats["composers_dropped_birth_year"] = len(composers) - len(filtered)
         return filtered
 
-    def _get_dynamic_part_score_threshold(self, work_wss: float) -> float:
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _get_dynamic_part_score_threshold(work_wss: float) -> float:
         """
         Calculates a dynamic minimum part score threshold using linear interpolation.
 
         A work with a high WSS will have a lower (more lenient) threshold than
-        a work with a low WSS.
+        a work with a low WSS. Works with the same part recording counts share a
+        WSS, so thresholds are cached per WSS value.
 
         :param work_wss: The Work Significance Score of the parent work.
         :return: The calculated minimum part score (0-100) for its parts.
@@ -448,8 +595,7 @@ class MusicbrainzProcessor:
                         self.stats["works_dropped_became_empty"] += 1
                     continue
 
-                if root_work.gid in WSS_OVERRIDES:
-                    wss = WSS_OVERRIDES[root_work.gid]
+                wss = WSS_OVERRIDES.get(root_work.gid, wss)
 
                 all_works.append(
                     FinalWork(
@@ -484,7 +630,7 @@ class MusicbrainzProcessor:
             filtered_list = [work for work in works if work.score >= MINIMUM_WSS and work.gid not in EXCLUDED_WORKS]
             self.stats["works_dropped_by_min_wss"] += initial_count - len(filtered_list)
 
-            filtered_list.sort(key=lambda w: w.score, reverse=True)
+            filtered_list.sort(key=attrgetter("score"), reverse=True)
             if filtered_list:
                 filtered_map[work_type] = filtered_list
         return filtered_map
@@ -500,7 +646,7 @@ class MusicbrainzProcessor:
         surviving in the final dataset.
         """
         composer_work_counts: Counter = Counter(
-            w.composer for works in final_works.values() for w in works
+            w.composer for w in chain.from_iterable(final_works.values())
         )
         final_composers: List[FinalComposer] = []
         for composer in original_composers:
@@ -518,15 +664,19 @@ class MusicbrainzProcessor:
             elif composer.gid in composer_work_counts:
                 self.stats["composers_dropped_min_works"] += 1
         
+        works_by_composer: Dict[str, List[FinalWork]] = defaultdict(list)
+        for work in all_works:
+            works_by_composer[work.composer].append(work)
+
         # Calculate raw scores
         # First, find the maximum work count across all composers
-        work_counts = [len([w for w in all_works if w.composer == c.gid]) for c in final_composers]
+        work_counts = [len(works_by_composer.get(c.gid, [])) for c in final_composers]
         max_work_count = max(work_counts) if work_counts else 0
         # Determine maximum WSS across all works (dynamic top score for normalization)
         max_wss = max((w.score for w in all_works), default=MINIMUM_WSS)
 
         raw_scores = [
-            self._calculate_composer_score(c.gid, all_works, max_work_count, max_wss)
+            self._calculate_composer_score(works_by_composer.get(c.gid, []), max_work_count, max_wss)
             for c in final_composers
         ]
 
@@ -541,9 +691,9 @@ class MusicbrainzProcessor:
                     normalized = 0.0
                 final_composer.score = round(normalized, 2)
         
-        return sorted(final_composers, key=lambda c: c.name)
+        return sorted(final_composers, key=attrgetter("name"))
 
-    def _calculate_composer_score(self, composer_gid: str, all_works: List[FinalWork], max_work_count: int, max_wss: float) -> float:
+    def _calculate_composer_score(self, composer_works: List[FinalWork], max_work_count: int, max_wss: float) -> float:
         """
         Calculates the composer score using a balanced formula that considers three key aspects:
         peak performance, overall depth, and volume of works. The score is designed to reward
@@ -587,13 +737,11 @@ class MusicbrainzProcessor:
         - Normalization ensures fairness across different eras and datasets by using relative scales.
         - Scores are clamped to 0-1 per component and combined to produce a final 0-100 score.
         
-        :param composer_gid: The unique GID of the composer.
-        :param all_works: List of all final works in the dataset.
+        :param composer_works: The composer's final works.
         :param max_work_count: The maximum number of works any composer has in the dataset.
         :param max_wss: The maximum WSS score of any work in the dataset.
         :return: The composer score as a float between 0 and 100.
         """
-        composer_works = [w for w in all_works if w.composer == composer_gid]
         if not composer_works:
             return 0.0
         
@@ -637,31 +785,19 @@ class MusicbrainzProcessor:
         5. Removing works that become empty after part deduplication.
         """
         gid_to_composers = defaultdict(set)
-        gid_to_first_work = {}
         
         for works in works_after_wss.values():
             for work in works:
                 gid_to_composers[work.gid].add(work.composer)
-                # Track the first occurrence of each gid
-                if work.gid not in gid_to_first_work:
-                    gid_to_first_work[work.gid] = work
 
         # Find gids with multiple composers (to remove entirely)
         gids_with_multiple_composers = {
             gid for gid, composers in gid_to_composers.items() if len(composers) > 1
         }
 
-        # Assign each deezer ID to the first work that contains it
+        # Each deezer ID belongs to the first work that contains it, claimed as the
+        # works are visited below
         deezer_to_work_gid = {}
-        for work_type, works in works_after_wss.items():
-            for work in works:
-                if work.gid in gids_with_multiple_composers:
-                    continue
-                for part in work.parts:
-                    for deezer_id in part.deezer:
-                        if deezer_id not in deezer_to_work_gid:
-                            deezer_to_work_gid[deezer_id] = work.gid
-
         filtered_works = {}
         seen_gids = set()
         duplicates_removed = 0
@@ -672,6 +808,10 @@ class MusicbrainzProcessor:
                 # Skip works with multiple composers
                 if work.gid in gids_with_multiple_composers:
                     continue
+                # Duplicates still claim their deezer IDs, before being skipped
+                for part in work.parts:
+                    for deezer_id in part.deezer:
+                        deezer_to_work_gid.setdefault(deezer_id, work.gid)
                 # Skip duplicate gids (keep only first occurrence)
                 if work.gid in seen_gids:
                     duplicates_removed += 1
@@ -681,13 +821,13 @@ class MusicbrainzProcessor:
                 # Filter parts: keep only those where at least one deezer ID is assigned to this work
                 filtered_parts = []
                 for part in work.parts:
-                    # Check if any deezer ID in this part belongs to this work
-                    if any(deezer_to_work_gid.get(deezer_id) == work.gid for deezer_id in part.deezer):
-                        # Filter the deezer IDs to only keep those assigned to this work
-                        part.deezer = [
-                            deezer_id for deezer_id in part.deezer
-                            if deezer_to_work_gid.get(deezer_id) == work.gid
-                        ]
+                    # Keep only the deezer IDs assigned to this work, if there are any
+                    owned_deezer = [
+                        deezer_id for deezer_id in part.deezer
+                        if deezer_to_work_gid.get(deezer_id) == work.gid
+                    ]
+                    if owned_deezer:
+                        part.deezer = owned_deezer
                         filtered_parts.append(part)
                     else:
                         self.stats["parts_dropped_cross_work_duplicate"] += 1
@@ -768,49 +908,59 @@ class MusicbrainzProcessor:
         """
         composer_name = composer.name
 
-        work_name_normalized = work.name.replace("’", "'").replace("“", '"').replace("”", '"')
+        work_name_normalized = work.name.translate(QUOTE_NORMALIZATION)
 
         if "Piano Sonata" in work_name_normalized and work.type == "Sonata":
             return "piano"
                 
-        if work.type in TYPE_MAPPING:
-            type_map = TYPE_MAPPING[work.type]
-            if type_map != "other":
-                return type_map
+        type_map = TYPE_MAPPING.get(work.type)
+        if type_map is not None and type_map != "other":
+            return type_map
 
         if "orch." in work_name_normalized:
             return "orchestral"
         
+        # Names repeat across works and composers; only composers with their own
+        # rules need a separate cache entry
+        if composer_name not in self.composer_specific_rules:
+            composer_name = None
+        cache_key = (composer_name, work_name_normalized)
+        if cache_key in self.rule_match_cache:
+            self.stats["rule_match_cache_hits"] += 1
+            rule_type = self.rule_match_cache[cache_key]
+        else:
+            self.stats["rule_match_cache_misses"] += 1
+            rule_type = self.rule_match_cache[cache_key] = self._match_rules(
+                work_name_normalized, composer_name
+            )
+
+        if rule_type is None:
+            self.unresolved_work_candidates[composer.gid].append((work.name, work.type))
+            return "other"
+        return rule_type
+
+    def _match_rules(self, work_name_normalized: str, composer_name: Optional[str]) -> Optional[str]:
+        """
+        Returns the first rule type whose patterns match the work name, trying the
+        composer-specific rules before the general ones, or None if nothing matches.
+        """
         # Composer specific rules
-        try:
-            if composer_name in self.composer_specific_rules:
-                for rule_type, patterns in self.composer_specific_rules[composer_name].items():
-                    if isinstance(patterns, list):
-                        for pattern in patterns:
-                            if isinstance(pattern, str):
-                                if re.search(pattern, work_name_normalized, re.IGNORECASE):
-                                    return rule_type
-                            else:
-                                print(f"Invalid pattern type: {type(pattern)} for {pattern}")
-                    else:
-                        print(f"Invalid patterns type for {composer_name} {rule_type}: {type(patterns)}")
-
-            # General rules
-            for rule_type, patterns in self.general_rules.items():
-                if isinstance(patterns, list):
-                    for pattern in patterns:
-                        if isinstance(pattern, str):
-                            if re.search(pattern, work_name_normalized, re.IGNORECASE):
-                                return rule_type
-                        else:
-                            print(f"Invalid pattern type: {type(pattern)} for {pattern}")
-                else:
-                    print(f"Invalid patterns type for general {rule_type}: {type(patterns)}")
-        except (re.error, TypeError) as e:
-            print(f"Error processing pattern: {e}, pattern: {pattern}")
+        if composer_name is not None:
+            classifier = self.composer_classifiers.get(composer_name)
+            if classifier is None:
+                classifier = self.composer_classifiers[composer_name] = self._compile_rules(
+                    self.composer_specific_rules[composer_name], composer_name
+                )
+            for rule_type, pattern in classifier:
+                if pattern.search(work_name_normalized):
+                    return rule_type
+
+        # General rules
+        for rule_type, pattern in self.general_classifier:
+            if pattern.search(work_name_normalized):
+                return rule_type
 
-        self.unresolved_work_candidates[composer.gid].append((work.name, work.type))
-        return "other"
+        return None
 
     def _select_deezer_ids(self, recordings: List[MBRecording], max_ids: int = 5) -> List[int]:
         """
@@ -833,39 +983,33 @@ class MusicbrainzProcessor:
         # Calculate max number to select: min of max_ids and ceil(n/2)
         max_to_select = min(max_ids, math.ceil(len(recordings) / 2))
         
-        # Sort recordings by length of title (longest first) - often better match
-        recordings.sort(key=lambda r: len(r.name), reverse=True)
+        # Preferred labels first (best label first), then other labelled recordings,
+        # then the rest. Within each tier, longest title first - often better match
+        unranked = len(LABEL_PREFERENCE)
+
+        def selection_order(rec: MBRecording) -> Tuple[int, int]:
+            if not rec.label:
+                tier = unranked + 1
+            else:
+                rank = label_rank(rec.label)
+                tier = unranked if rank is None else rank
+            return tier, -len(rec.name)
+
+        recordings.sort(key=selection_order)
 
         selected_ids = []
-        with_labels = [r for r in recordings if r.label]
-        
-        # First, try to select from preferred labels
-        for pref in LABEL_PREFERENCE:
-            for rec in with_labels:
-                if rec.label and pref.lower() in rec.label.lower() and rec.deezerId not in selected_ids:
-                    selected_ids.append(rec.deezerId)
-                    if len(selected_ids) >= max_to_select:
-                        return selected_ids
-        
-        # Then fill with remaining recordings with labels
-        for rec in with_labels:
-            if rec.deezerId not in selected_ids:
-                selected_ids.append(rec.deezerId)
-                if len(selected_ids) >= max_to_select:
-                    return selected_ids
-        
-        # Finally, fill with any remaining recordings
+        seen_ids = set()
         for rec in recordings:
-            if rec.deezerId not in selected_ids:
+            if rec.deezerId not in seen_ids:
+                seen_ids.add(rec.deezerId)
                 selected_ids.append(rec.deezerId)
                 if len(selected_ids) >= max_to_select:
-                    return selected_ids
-        
+                    break
         return selected_ids
 
     def _write_unresolved_log(self, final_output: FinalOutput) -> None:
         """Writes a log of works in the final output whose types remain 'other'."""
-        composer_map = {c.gid: c.name for c in final_output.composers}
+        composer_map = final_output.composer_names
         final_unresolved = {(w.composer, w.name) for w in final_output.works if w.type == "other"}
         grouped = defaultdict(list)
         for composer_gid, works in self.unresolved_work_candidates.items():
@@ -932,19 +1076,25 @@ class MusicbrainzProcessor:
         print(
             f"{'Works dropped (empty after Deezer dedup):':<45} {self.stats['works_dropped_empty_after_deezer_dedup']}"
         )
+        rule_lookups = self.stats["rule_match_cache_hits"] + self.stats["rule_match_cache_misses"]
+        if rule_lookups:
+            print(
+                f"{'Work type rule cache hit rate:':<45} {self.stats['rule_match_cache_hits'] / rule_lookups:.1%}"
+            )
         print(f"{'Total final works in output:':<45} {total_final_works}")
         print(f"{'Total final parts in output:':<45} {total_final_parts}")
 
-        composer_map = {c.gid: c.name for c in final_output.composers}
+        composer_map = final_output.composer_names
+        works_by_composer = final_output.works_by_composer
         composer_stats = []
         for gid, name in composer_map.items():
-            works_for_composer = [w for w in all_final_works if w.composer == gid]
+            works_for_composer = works_by_composer.get(gid, [])
             work_count = len(works_for_composer)
             part_count = sum(len(w.parts) for w in works_for_composer)
             avg_parts = part_count / work_count if work_count > 0 else 0
             composer_stats.append((name, work_count, part_count, avg_parts))
 
-        composer_stats.sort(key=lambda x: x[1], reverse=True)
+        composer_stats.sort(key=itemgetter(1), reverse=True)
         print("\n--- Composers by Final Work Count ---")
         print(f"{'#':>3} {'Composer':<35} {'Works':>7} {'Parts':>7} {'Avg Parts':>10}")
         print(f"{'-'*3} {'-'*35} {'-'*7} {'-'*7} {'-'*10}")
@@ -952,8 +1102,8 @@ class MusicbrainzProcessor:
             print(f"{i+1:3}. {name:<35} {wc:>7} {pc:>7} {ap:>10.1f}")
 
         print("\n--- Top 50 Works by Score (All Types) ---")
-        all_final_works.sort(key=lambda w: w.score, reverse=True)
-        for i, work in enumerate(all_final_works[:50]):
+        top_works = heapq.nlargest(50, all_final_works, key=attrgetter("score"))
+        for i, work in enumerate(top_works):
             print(
                 f"{i+1:3}. {work.name:<50} ({composer_map.get(work.composer, 'N/A')}) -> Score: {work.score:.2f}"
             )
@@ -961,7 +1111,7 @@ class MusicbrainzProcessor:
         print("\n--- Final Data Distribution by Type ---")
         type_counts = Counter(w.type for w in final_output.works)
         for type_name, count in sorted(
-            type_counts.items(), key=lambda item: item[1], reverse=True
+            type_counts.items(), key=itemgetter(1), reverse=True
         ):
             print(f"  - {type_name:<12}: {count} works")
 
@@ -984,10 +1134,10 @@ def generate_markdown_report(final_output: FinalOutput) -> None:
 
     :param final_output: The final, curated data object.
     """
-    composer_map = {c.gid: c.name for c in final_output.composers}
+    composer_map = final_output.composer_names
     all_works = final_output.works
 
-    with open("lisztnup.md", "w", encoding="utf-8") as f:
+    with open("lisztnup.md", "w", encoding="utf-8", buffering=1 << 20) as f:
         f.write("# LisztNUp Curated Works\n\n")
         f.write(
             "A curated list of classical works, sorted by composer and work title.\n\n"
@@ -1011,10 +1161,10 @@ def generate_markdown_report(final_output: FinalOutput) -> None:
             work_cell = f"{work.name} {year_str}".strip()
             work_score_cell = f"{work.score:.2f}"
 
-            parts_cell_items = []
-            for part in sorted(work.parts, key=lambda p: p.name):
-                parts_cell_items.append(f"* {part.name} ({part.score:.2f})")
-            parts_cell = "<br>".join(parts_cell_items)
+            parts_cell = "<br>".join(
+                f"* {part.name} ({part.score:.2f})"
+                for part in sorted(work.parts, key=attrgetter("name"))
+            )
 
             f.write(
                 f"| {composer_name} | {work_cell} | {work_score_cell} | {parts_cell} |\n"
@@ -1026,30 +1176,67 @@ def generate_markdown_report(final_output: FinalOutput) -> None:
 # --- Main Execution Block ---
 # ==============================================================================
 
-def compact_json_dumps(data, indent=2):
-    """Pretty print JSON with indent, but keep number arrays on one line."""
-    # First, do normal pretty printing
-    pretty = json.dumps(data, indent=indent)
-    
-    # Find all number arrays that span multiple lines
-    def compress_array(match):
-        # Extract the array string and parse it
-        array_str = match.group(0)
-        # Remove all whitespace and newlines
-        return re.sub(r'\s+', ' ', array_str).replace('[ ', '[').replace(' ]', ']')
-    
-    # Replace multi-line number arrays with single-line versions
-    pattern_multiline = r'\[\s*\n\s*(-?\d+\.?\d*\s*,?\s*\n?\s*)+\]'
-    result = re.sub(pattern_multiline, compress_array, pretty)
-    
-    return result
+@lru_cache(maxsize=None)
+def label_rank(label: str) -> Optional[int]:
+    """
+    Returns the rank of the first LABEL_PREFERENCE entry contained in the label
+    (case-insensitive), or None if it contains none of them.
+    """
+    label = label.lower()
+    for preferred, rank in LABEL_RANK.items():
+        if preferred in label:
+            return rank
+    return None
+
+def write_compact_json(data, write, indent=2, level=0):
+    """
+    Writes data as indented JSON through the write callable, keeping number
+    arrays on one line. Matches json.dumps(data, indent=indent) except for
+    those arrays, which are written like json.dumps(array).
+    """
+    if isinstance(data, dict):
+        if not data:
+            write("{}")
+            return
+        separator = ",\n" + " " * (indent * (level + 1))
+        write("{")
+        prefix = separator[1:]
+        for key, value in data.items():
+            write(prefix)
+            prefix = separator
+            write(encode_basestring_ascii(key) + ": ")
+            # Strings are the most common values, so skip the recursion for them
+            if isinstance(value, str):
+                write(encode_basestring_ascii(value))
+            elif isinstance(value, (dict, list)):
+                write_compact_json(value, write, indent, level + 1)
+            else:
+                write(json.dumps(value))
+        write("\n" + " " * (indent * level) + "}")
+    elif isinstance(data, list):
+        if not data:
+            write("[]")
+        elif all(type(item) in (int, float) for item in data):
+            write(json.dumps(data))
+        else:
+            separator = ",\n" + " " * (indent * (level + 1))
+            write("[")
+            prefix = separator[1:]
+            for item in data:
+                write(prefix)
+                prefix = separator
+                write_compact_json(item, write, indent, level + 1)
+            write("\n" + " " * (indent * level) + "]")
+    else:
+        write(json.dumps(data))
 
-def load_excluded_deezer_ids() -> set[int]:
+def load_excluded_deezer_ids() -> FrozenSet[int]:
     """Load excluded Deezer IDs from file."""
     path = Path("excluded_deezer_ids")
     if path.exists():
-        return set(int(line.strip()) for line in path.read_text().splitlines() if line.strip())
-    return set()
+        with path.open("rb") as f:
+            return frozenset(int(line) for line in f if not line.isspace())
+    return frozenset()
 
 
 def main() -> None:
@@ -1078,9 +1265,9 @@ def main() -> None:
     processor = MusicbrainzProcessor(composers_data)
     final_output = processor.process()
 
-    with open("../static/lisztnup.json", "w", encoding="utf-8") as f:
-        json_output = final_output.to_dict()
-        f.write(compact_json_dumps(json_output, indent=2))
+    # Written in many small pieces, so use a large buffer
+    with open("../static/lisztnup.json", "w", encoding="utf-8", buffering=1 << 20) as f:
+        final_output.write_json(f.write, indent=2)
     print(f"\nSuccessfully processed data and saved to 'lisztnup.json'.")
 
     generate_markdown_report(final_output)
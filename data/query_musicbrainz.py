@@ -62,17 +62,31 @@ Operational notes
 
 - Requires a local PostgreSQL MusicBrainz database and psycopg2.
 - Uses server-side SQL plus Python recursion; runtime depends on DB size and
-    indexing.
+    indexing. Work trees are prefetched for a chunk of top-level works at a
+    time (a recursive CTE for the hierarchy, then one recordings query), and
+    the recursion then runs over the in-memory rows.
 - Intended to run from data/ so relative paths and output location are
     predictable.
 """
 
 import psycopg2
 import psycopg2.extras
+import heapq
 import json
 import re
+import string
+from bisect import bisect_right
 from collections import defaultdict, Counter
+from dataclasses import dataclass
+from functools import lru_cache
+from operator import itemgetter
 import traceback
+from typing import Any, Dict, List, Optional
+
+try:
+    import orjson  # Optional, faster JSON serialisation
+except ImportError:
+    orjson = None
 
 # --- Database Configuration ---
 DB_CONFIG = {
@@ -145,18 +159,151 @@ TAG_TO_WORK_TYPE = {
 }
 
 
+# Number of top-level work groups whose trees are prefetched together.
+PREFETCH_CHUNK_SIZE = 500
+# Rows fetched per round-trip while streaming the top-level works.
+TOP_LEVEL_ITERSIZE = 10000
+
+
+# --- Output Data Classes (for 'musicbrainz.json') ---
+# Slotted to keep the in-memory tree compact; converted to dicts only while
+# serialising (see json_default).
+@dataclass(slots=True)
+class Recording:
+    """A recording of a work or subwork."""
+
+    gid: str
+    name: str
+    isrc: Optional[str]
+    label: Optional[str]
+    deezerId: Optional[int]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "gid": self.gid,
+            "name": self.name,
+            "isrc": self.isrc,
+            "label": self.label,
+            "deezerId": self.deezerId,
+        }
+
+
+@dataclass(slots=True)
+class Subwork:
+    """A part of a work. Has no type of its own; consumers inherit the parent's."""
+
+    gid: str
+    name: str
+    begin_year: Optional[int]
+    end_year: Optional[int]
+    recordings: List[Recording]
+    subworks: List["Subwork"]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "gid": self.gid,
+            "name": self.name,
+            "begin_year": self.begin_year,
+            "end_year": self.end_year,
+            "recordings": self.recordings,
+            "subworks": self.subworks,
+        }
+
+
+@dataclass(slots=True)
+class Work:
+    """A top-level work of a composer."""
+
+    gid: str
+    name: str
+    type: str
+    begin_year: Optional[int]
+    end_year: Optional[int]
+    recordings: List[Recording]
+    subworks: List[Subwork]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "gid": self.gid,
+            "name": self.name,
+            "type": self.type,
+            "begin_year": self.begin_year,
+            "end_year": self.end_year,
+            "recordings": self.recordings,
+            "subworks": self.subworks,
+        }
+
+
+@dataclass(slots=True)
+class Composer:
+    """A composer and their top-level works."""
+
+    gid: str
+    name: str
+    birth_year: Optional[int]
+    death_year: Optional[int]
+    works: List[Work]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "gid": self.gid,
+            "name": self.name,
+            "birth_year": self.birth_year,
+            "death_year": self.death_year,
+            "works": self.works,
+        }
+
+
+def json_default(obj):
+    """json.dumps hook: the to_dict() methods are shallow, nested objects come back here."""
+    return obj.to_dict()
+
+
+def dumps_compact(obj) -> bytes:
+    """Compact UTF-8 JSON, with orjson if available and the same bytes either way."""
+    if orjson:
+        # Dataclasses go through json_default too, so their to_dict() keys are used
+        return orjson.dumps(obj, default=json_default, option=orjson.OPT_PASSTHROUGH_DATACLASS)
+    return json.dumps(
+        obj, ensure_ascii=False, separators=(",", ":"), default=json_default
+    ).encode("utf-8")
+
+
 # --- Helper Function ---
+_NON_ALNUM_RE = re.compile(r"[^a-z0-9]+")
+# Deletes every ASCII character outside [a-z0-9] in a single translate() pass.
+_ASCII_NON_ALNUM = str.maketrans(
+    "", "", "".join(chr(c) for c in range(128) if chr(c) not in "abcdefghijklmnopqrstuvwxyz0123456789")
+)
+
+
+@lru_cache(maxsize=100_000)
 def normalize_name(name):
     """Lowercase and remove all non-alphanumeric characters for merging."""
     if not name:
         return ""
-    return re.sub(r"[^a-z0-9]", "", name.lower())
+    lowered = name.lower()
+    if lowered.isascii():
+        return lowered.translate(_ASCII_NON_ALNUM)
+    return _NON_ALNUM_RE.sub("", lowered)
 
 forbidden_artist_comment = ['band', 'score composer', 'producer', 'songwriter', 'film', 'soundtrack', 'TV', 'pop', 'rock', 'jazz', 'hip hop', 'rap', 
                     'metal', 'punk', 'electronic', 'folk', 'country', 'dj', 'dance', 'reggae', 'new age', 'fusion', 'crossover'
                     'blues', 'r&b', 'soul', 'schlager']
 patterns = [f"%{x}%" for x in forbidden_artist_comment]
 
+# Characters a top-level work name may start with: letters (Latin-1 accented
+# ones included), digits and opening quotes. Checked with strpos() on the first
+# character rather than a case-insensitive regex for every candidate row. Case
+# partners are listed explicitly (œ for Œ, Ÿ for ÿ), so the filter does not
+# depend on the database's collation.
+WORK_NAME_FIRST_CHARS = (
+    string.ascii_letters
+    + string.digits
+    + "".join(map(chr, range(0xC0, 0x100)))  # À-ÿ
+    + "ŒœŸ\"“„‘'"
+)
+
 # --- SQL Queries ---
 GET_TOP_LEVEL_WORKS_SQL = """
 WITH classical_composers AS (
@@ -216,7 +363,8 @@ eligible_works AS (
     AND l.attribute_count = 0 -- Primary composer, not additional
     AND law.entity0 IN (SELECT id FROM classical_composers)
     -- Work-level filters (apply uniformly)
-    AND COALESCE(
+    -- Work name must start with letter, number, or quote (WORK_NAME_FIRST_CHARS)
+    AND strpos(%s, NULLIF(LEFT(COALESCE(
       (SELECT wa.name 
        FROM musicbrainz.work_alias AS wa
        WHERE wa.work = w.id 
@@ -227,7 +375,7 @@ eligible_works AS (
          wa.id
        LIMIT 1),
       w.name
-    ) ~* '^[A-Za-zÀ-ÿŒ0-9"“„‘'']'  -- Work name must start with letter, number, or quote
+    ), 1), '')) > 0
     AND COALESCE(w.type, 17) NOT IN(19, 20, 21, 22, 23, 25, 26, 28, 29) -- Exclude non-classical work types
     AND NOT EXISTS (
       -- Exclude works that are parts or arrangements of other works
@@ -335,7 +483,7 @@ GROUP BY
 ORDER BY c.sort_name, work_name;
 """
 
-# SQL to get recordings for a given work ID
+# SQL to get recordings for a batch of work IDs
 # Advanced checks to filter out non-classical covers etc.
 GET_RECORDINGS_FOR_WORK_SQL = """
 -- This CTE recursively finds all link_type IDs that are descendants of
@@ -355,15 +503,21 @@ WITH RECURSIVE artist_link_types AS (
     FROM musicbrainz.link_type AS lt
     JOIN artist_link_types AS alt ON lt.parent = alt.id
 )
-SELECT r.gid AS recording_gid, 
+SELECT lrw.entity1 AS work_id,
+       r.gid AS recording_gid, 
        r.name AS recording_name, 
        i.isrc,
        STRING_AGG(DISTINCT label.name, ', ') AS recording_labels, 
-       d.track_id AS deezer_id,
-       STRING_AGG(DISTINCT at.name, ', ') AS attributes,
-       STRING_AGG(DISTINCT artist.name, '; ') AS artist_name,
-       STRING_AGG(DISTINCT artist.comment, '; ') AS artist_comment,
-       STRING_AGG(DISTINCT acn.name, '; ') AS artist_credit_name
+       -- The recording is kept, but without its Deezer ID, when an artist
+       -- comment contains a forbidden term, the artist credit has no space
+       -- (most often a band name) or it is a medley, cover or karaoke version
+       CASE
+           WHEN BOOL_OR(LOWER(artist.comment) LIKE ANY (%(comment_patterns)s))
+             OR STRING_AGG(DISTINCT acn.name, '; ') NOT LIKE '%% %%'
+             OR BOOL_OR(LOWER(at.name) IN ('medley', 'cover', 'karaoke'))
+           THEN NULL
+           ELSE d.track_id
+       END AS deezer_id
 FROM musicbrainz.recording AS r
 -- Join to get the link between recording and work
 JOIN musicbrainz.l_recording_work AS lrw ON r.id = lrw.entity0
@@ -389,16 +543,33 @@ ON r.id = lar.entity1 AND l_ar.link_type IN (SELECT id FROM artist_link_types)
 LEFT JOIN musicbrainz.artist_credit_name AS acn ON r.artist_credit = acn.artist_credit
 -- Join artist table for both sources
 LEFT JOIN musicbrainz.artist AS artist ON (acn.artist = artist.id OR lar.entity0 = artist.id)
-WHERE lrw.entity1 = %(work_id)s
-GROUP BY r.gid, r.name, i.isrc, d.track_id
+WHERE lrw.entity1 = ANY(%(work_ids)s)
+GROUP BY lrw.entity1, r.gid, r.name, i.isrc, d.track_id
 -- Exclude partial recordings
 HAVING STRING_AGG(DISTINCT at.name, ', ') IS NULL 
     OR STRING_AGG(DISTINCT at.name, ', ') NOT ILIKE '%%partial%%'
-ORDER BY r.name;
+ORDER BY lrw.entity1, r.name;
 """
 
-GET_SUBWORKS_FOR_WORK_SQL = """
-SELECT DISTINCT ON (lww.link_order, child_work.id, work_name)
+# Walks the whole "parts" hierarchy below a batch of work IDs in one query.
+# Returns one row per (parent, child) link; UNION keeps cyclic links finite.
+GET_SUBWORK_TREES_SQL = """
+WITH RECURSIVE parts AS (
+  SELECT lww.entity0, lww.entity1, lww.link_order, l.begin_date_year, l.end_date_year
+  FROM musicbrainz.l_work_work AS lww
+  JOIN musicbrainz.link AS l ON lww.link = l.id
+  WHERE lww.entity0 = ANY(%(work_ids)s) AND l.link_type = 281
+
+  UNION
+
+  SELECT lww.entity0, lww.entity1, lww.link_order, l.begin_date_year, l.end_date_year
+  FROM parts
+  JOIN musicbrainz.l_work_work AS lww ON lww.entity0 = parts.entity1
+  JOIN musicbrainz.link AS l ON lww.link = l.id
+  WHERE l.link_type = 281
+)
+SELECT DISTINCT ON (parts.entity0, parts.link_order, child_work.id, work_name)
+  parts.entity0 AS parent_work_id,
   child_work.id AS work_id,
   child_work.gid AS work_gid,
   COALESCE(
@@ -414,67 +585,152 @@ SELECT DISTINCT ON (lww.link_order, child_work.id, work_name)
     child_work.name
   ) AS work_name,
   child_work.type AS work_type,
-  l.begin_date_year AS work_begin_year,
-  l.end_date_year AS work_end_year
-FROM musicbrainz.l_work_work AS lww
-JOIN musicbrainz.link AS l ON lww.link = l.id
-JOIN musicbrainz.work AS child_work ON lww.entity1 = child_work.id
-WHERE lww.entity0 = %(work_id)s AND l.link_type = 281
-ORDER BY lww.link_order, work_name;
+  parts.begin_date_year AS work_begin_year,
+  parts.end_date_year AS work_end_year
+FROM parts
+JOIN musicbrainz.work AS child_work ON parts.entity1 = child_work.id
+ORDER BY parts.entity0, parts.link_order, work_name;
 """
 
-def get_work_details_recursive(cursor, work_id, label_counter):
-    # Returns: subworks, recordings, total_recordings, descendant_types
-    cursor.execute(GET_RECORDINGS_FOR_WORK_SQL, {"work_id": work_id})
-    recordings_data = cursor.fetchall()
-    recordings = []
-    for rec in recordings_data:
-        deezer_id = rec.get("deezer_id")
-
-        artist_comment = rec.get("artist_comment") or ""
-        # Exclude recordings where the artist comment contains forbidden terms
-        if any(term in artist_comment.lower() for term in forbidden_artist_comment):
-            deezer_id = None
-
-        # Exclude recordings where the artist credit name does not contain a space, most often a band name
-        if ' ' not in rec.get("artist_credit_name", ''):
-            deezer_id = None
-        
-        # The SQL returns an `attributes` column which is a
-        # comma-separated string (e.g. 'live, partial'). When any of the
-        # excluded attributes are present, exclude
-        attrs = rec.get("attributes") or ""
-        attr_list = [a.strip().lower() for a in attrs.split(",") if a and a.strip()]
-        if any(a in ("medley", "cover", "karaoke") for a in attr_list):
-            deezer_id = None
-
-        recordings.append(
-            {
-                "gid": rec["recording_gid"],
-                "name": rec["recording_name"],
-                "isrc": rec["isrc"],
-                "label": rec["recording_labels"],
-                "deezerId": deezer_id
-            }
+# Lookup indexes for the tree walk, as (table, leading column, statement). A
+# stock MusicBrainz schema already has indexes leading with these columns;
+# mirrors imported without them otherwise fall back to sequential scans of the
+# link tables for every batch.
+# (link_type lives on musicbrainz.link, so the subwork index covers the link
+# column rather than filtering on the part-of link type.)
+ENSURE_INDEXES = [
+    (
+        "musicbrainz.l_work_work",
+        "entity0",
+        "CREATE INDEX IF NOT EXISTS l_work_work_idx_entity0_link"
+        " ON musicbrainz.l_work_work (entity0, link)",
+    ),
+    (
+        "musicbrainz.l_recording_work",
+        "entity1",
+        "CREATE INDEX IF NOT EXISTS l_recording_work_idx_entity1"
+        " ON musicbrainz.l_recording_work (entity1)",
+    ),
+]
+
+# Whether the table has a valid index whose first key column is the column
+HAS_LEADING_INDEX_SQL = """
+SELECT EXISTS (
+  SELECT 1
+    FROM pg_index AS i
+    JOIN pg_attribute AS a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+   WHERE i.indrelid = %s::regclass
+     AND a.attname = %s
+     AND i.indisvalid
+);
+"""
+
+
+def ensure_indexes(conn):
+    """Creates the indexes used by the tree walk if no index serves them yet.
+
+    An index is only built when the table has no index leading with the
+    looked-up column, whatever its name; the stock MusicBrainz indexes are
+    never duplicated. Needs CREATE privileges on the musicbrainz schema;
+    without them the script carries on with whatever indexes exist.
+    """
+    try:
+        with conn.cursor() as cursor:
+            for table, column, statement in ENSURE_INDEXES:
+                cursor.execute(HAS_LEADING_INDEX_SQL, (table, column))
+                if not cursor.fetchone()[0]:
+                    print(f"Creating lookup index on {table} ({column})...")
+                    cursor.execute(statement)
+        conn.commit()
+    except psycopg2.Error as error:
+        conn.rollback()
+        print(f"Could not create lookup indexes, continuing without them: {error}")
+
+
+def prefetch_work_trees(cursor, root_ids):
+    """Loads recordings and subwork rows for every work below root_ids.
+
+    The parts hierarchy is expanded server-side by a recursive CTE, then the
+    recordings of every work in it are fetched at once: two queries per
+    batch regardless of how large or deep the trees are.
+    Returns (recordings_by_work, subworks_by_work), both keyed by work id.
+    """
+    recordings_by_work = defaultdict(list)
+    subworks_by_work = defaultdict(list)
+    work_ids = set(root_ids)
+
+    # Plain tuple rows; the leading column is the key and is dropped so the
+    # rest can be unpacked in the column order of the SELECT list.
+    cursor.execute(GET_SUBWORK_TREES_SQL, {"work_ids": list(work_ids)})
+    for sw in cursor.fetchall():
+        subworks_by_work[sw[0]].append(sw[1:])
+        work_ids.add(sw[1])
+
+    cursor.execute(
+        GET_RECORDINGS_FOR_WORK_SQL,
+        {"work_ids": list(work_ids), "comment_patterns": patterns},
+    )
+    for rec in cursor.fetchall():
+        recordings_by_work[rec[0]].append(rec[1:])
+    return recordings_by_work, subworks_by_work
+
+
+def iter_groups_with_trees(cursor, grouped_works):
+    """Yields (key, duplicates, prefetched) for each group of top-level works,
+    prefetching the trees of PREFETCH_CHUNK_SIZE groups at a time."""
+    items = list(grouped_works.items())
+    for start in range(0, len(items), PREFETCH_CHUNK_SIZE):
+        chunk = items[start:start + PREFETCH_CHUNK_SIZE]
+        prefetched = prefetch_work_trees(
+            cursor, [row.work_id for _, duplicates in chunk for row in duplicates]
         )
+        for key, duplicates in chunk:
+            yield key, duplicates, prefetched
+
 
-    # if not a single recording has a deezerId, skip this work
-    if all(rec["deezerId"] is None for rec in recordings):
-        recordings = []
+def get_work_details_recursive(prefetched, work_id, cache):
+    # Returns: subworks, recordings, total_recordings, descendant_types, labels
+    # `labels` lists the label of every counted recording in the subtree, so a
+    # result served from `cache` (keyed by work_id) can replay its label counts.
+    cached = cache.get(work_id)
+    if cached is not None:
+        return cached
 
-    for rec in recordings:
-        if rec["label"]:
-            label_counter.update([rec["label"]])
+    recordings_by_work, subworks_by_work = prefetched
+    recordings_data = recordings_by_work.get(work_id, [])
+    recordings = []
+    labels = []
+    # if not a single recording has a deezerId, skip this work's recordings
+    # before building them; rows are (gid, name, isrc, label, deezer_id)
+    if any(row[4] is not None for row in recordings_data):
+        for (
+            recording_gid,
+            recording_name,
+            isrc,
+            recording_labels,
+            deezer_id,
+        ) in recordings_data:
+            recordings.append(
+                Recording(
+                    gid=recording_gid,
+                    name=recording_name,
+                    isrc=isrc,
+                    label=recording_labels,
+                    deezerId=deezer_id,
+                )
+            )
+            if recording_labels:
+                labels.append(recording_labels)
 
     total_recordings_in_tree = len(recordings)
     all_descendant_types = []
 
-    cursor.execute(GET_SUBWORKS_FOR_WORK_SQL, {"work_id": work_id})
-    subworks_data = cursor.fetchall()
+    subworks_data = subworks_by_work.get(work_id, [])
 
+    # Rows are (work_id, work_gid, work_name, work_type, begin_year, end_year)
     grouped_subworks = defaultdict(list)
     for sw in subworks_data:
-        grouped_subworks[normalize_name(sw["work_name"])].append(sw)
+        grouped_subworks[normalize_name(sw[2])].append(sw)
 
     valid_subworks = []
     for normalized_name, duplicates in grouped_subworks.items():
@@ -484,9 +740,10 @@ def get_work_details_recursive(cursor, work_id, label_counter):
             best_subwork_details = None
             max_recs = -1
             for subwork_row in duplicates:
-                sub, recs, count, types = get_work_details_recursive(
-                    cursor, subwork_row["work_id"], label_counter
+                sub, recs, count, types, sub_labels = get_work_details_recursive(
+                    prefetched, subwork_row[0], cache
                 )
+                labels.extend(sub_labels)
                 if count > max_recs:
                     max_recs = count
                     winner_row = subwork_row
@@ -503,28 +760,33 @@ def get_work_details_recursive(cursor, work_id, label_counter):
                 child_recordings,
                 child_rec_count,
                 child_descendant_types,
-            ) = get_work_details_recursive(cursor, winner_row["work_id"], label_counter)
+                sub_labels,
+            ) = get_work_details_recursive(prefetched, winner_row[0], cache)
+            labels.extend(sub_labels)
 
+        _, winner_gid, winner_name, winner_type, begin_year, end_year = winner_row
         # Add the winner's direct type to the list
-        if winner_row["work_type"]:
-            all_descendant_types.append(winner_row["work_type"])
+        if winner_type:
+            all_descendant_types.append(winner_type)
         # Add all types from its children
         all_descendant_types.extend(child_descendant_types)
 
         if child_rec_count > 0:
             total_recordings_in_tree += child_rec_count
             valid_subworks.append(
-                {
-                    "gid": winner_row["work_gid"],
-                    "name": winner_row["work_name"],
-                    "begin_year": winner_row["work_begin_year"],
-                    "end_year": winner_row["work_end_year"],
-                    "recordings": child_recordings,
-                    "subworks": child_subworks,
-                }
+                Subwork(
+                    gid=winner_gid,
+                    name=winner_name,
+                    begin_year=begin_year,
+                    end_year=end_year,
+                    recordings=child_recordings,
+                    subworks=child_subworks,
+                )
             )
 
-    return valid_subworks, recordings, total_recordings_in_tree, all_descendant_types
+    result = (valid_subworks, recordings, total_recordings_in_tree, all_descendant_types, labels)
+    cache[work_id] = result
+    return result
 
 
 def print_statistics(final_data, stats):
@@ -533,7 +795,7 @@ def print_statistics(final_data, stats):
     print(" " * 30 + "FINAL DATA STATISTICS")
     print("=" * 80)
 
-    total_top_level_works = sum(len(c["works"]) for c in final_data)
+    total_top_level_works = sum(len(c.works) for c in final_data)
 
     print("\n--- Overall Summary ---")
     print(f"{'Total Composers Found:':<35} {len(final_data)}")
@@ -541,25 +803,19 @@ def print_statistics(final_data, stats):
     print(f"{'Total Recordings Found:':<35} {stats['total_recordings']}")
 
     print("\n--- Top 200 Composers by Number of Works ---")
-    top_composers = sorted(final_data, key=lambda c: len(c["works"]), reverse=True)[
-        :200
-    ]
+    top_composers = heapq.nlargest(200, final_data, key=lambda c: len(c.works))
     for i, composer in enumerate(top_composers):
-        print(f"{i+1:3}. {composer['name']:<40} ({len(composer['works'])} works)")
+        print(f"{i+1:3}. {composer.name:<40} ({len(composer.works)} works)")
 
     print("\n--- Top 20 Works by Total Recordings (incl. sub-works) ---")
-    top_works = sorted(
-        stats["works_by_recording_count"], key=lambda x: x[2], reverse=True
-    )[:20]
+    top_works = heapq.nlargest(20, stats["works_by_recording_count"], key=itemgetter(2))
     for i, (work_name, composer_name, count) in enumerate(top_works):
         print(f"{i+1:2}. {count:<5} recordings - {work_name} ({composer_name})")
 
     print("\n--- Composer Distribution by Century of Birth ---")
-    century_counts = defaultdict(int)
-    for composer in final_data:
-        if composer["birth_year"]:
-            century = composer["birth_year"] // 100 + 1
-            century_counts[century] += 1
+    century_counts = Counter(
+        composer.birth_year // 100 + 1 for composer in final_data if composer.birth_year
+    )
     for century in sorted(century_counts.keys()):
         print(f"{century}th Century: {century_counts[century]} composers")
 
@@ -595,12 +851,14 @@ def print_statistics(final_data, stats):
         (101, 250),
         (251, float("inf")),
     ]
+    # Buckets are contiguous over the integers, so the last lower bound <= count
+    # picks the bucket
+    lower_bounds = [lower for lower, _ in buckets]
     bucket_counts = defaultdict(int)
     for count in stats["recordings_per_work_dist"]:
-        for lower, upper in buckets:
-            if lower <= count <= upper:
-                bucket_counts[(lower, upper)] += 1
-                break
+        index = bisect_right(lower_bounds, count) - 1
+        if index >= 0:
+            bucket_counts[buckets[index]] += 1
     for lower, upper in buckets:
         label = f"{lower}-{upper if upper != float('inf') else 'inf'}"
         count = bucket_counts.get((lower, upper), 0)
@@ -622,44 +880,64 @@ def main():
 
     try:
         conn = psycopg2.connect(**DB_CONFIG)
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        ensure_indexes(conn)
+        cursor = conn.cursor()
         print("Fetching and grouping top-level works...")
-        cursor.execute(GET_TOP_LEVEL_WORKS_SQL, (patterns,))
-        top_level_works_raw = cursor.fetchall()
-
+        # Stream the candidates through a server-side cursor rather than
+        # materialising the whole result set client-side first. Grouping still
+        # needs a dict: rows are ordered by display name, so duplicates that only
+        # match after normalisation are not necessarily adjacent.
         grouped_works = defaultdict(list)
-        for work in top_level_works_raw:
-            orchestrators = [o.split(", ")[0] for o in work["orchestrators"].split("; ") if not o.startswith("[")] if work["orchestrators"] else []
-            arrangers = [a.split(", ")[0] for a in work["arrangers"].split("; ") if not a.startswith("[")] if work["arrangers"] else []
+        candidate_count = 0
+        with conn.cursor(
+            "top_level_works", cursor_factory=psycopg2.extras.NamedTupleCursor
+        ) as works_cursor:
+            works_cursor.itersize = TOP_LEVEL_ITERSIZE
+            works_cursor.execute(
+                GET_TOP_LEVEL_WORKS_SQL, (patterns, WORK_NAME_FIRST_CHARS)
+            )
+            for work in works_cursor:
+                candidate_count += 1
+                orchestrators = [o.split(", ")[0] for o in work.orchestrators.split("; ") if not o.startswith("[")] if work.orchestrators else []
+                arrangers = [a.split(", ")[0] for a in work.arrangers.split("; ") if not a.startswith("[")] if work.arrangers else []
 
-            work_name = work["work_name"]
+                work_name = work.work_name
 
-            if orchestrators:
-                work_name += " (orch. " + ", ".join(orchestrators) + ")"
-            elif arrangers:
-                work_name += " (arr. " + ", ".join(arrangers) + ")"
+                if orchestrators:
+                    work_name += " (orch. " + ", ".join(orchestrators) + ")"
+                elif arrangers:
+                    work_name += " (arr. " + ", ".join(arrangers) + ")"
 
-            work["work_name"] = work_name
-            grouped_works[
-                (work["composer_id"], normalize_name(work_name))
-            ].append(work)
+                if work_name != work.work_name:
+                    work = work._replace(work_name=work_name)
+                grouped_works[
+                    (work.composer_id, normalize_name(work_name))
+                ].append(work)
 
         print(
-            f"Found {len(top_level_works_raw)} candidate works, grouped into {len(grouped_works)} unique top-level works."
+            f"Found {candidate_count} candidate works, grouped into {len(grouped_works)} unique top-level works."
         )
         print(f"\n{'COMPOSER':<30}\t{'WORK':<60}\t{'RECORDINGS'}")
         print(f"{'-'*30}\t{'-'*60}\t{'-'*10}")
 
-        for (composer_id, normalized_name), duplicates in grouped_works.items():
+        # Subtree results by work id; a work can be reached from several parents
+        # or be re-evaluated as a duplicate candidate.
+        subtree_cache = {}
+        # Labels of every evaluated recording, counted in one go after the loop
+        counted_labels = []
+        for (composer_id, normalized_name), duplicates, prefetched in iter_groups_with_trees(
+            cursor, grouped_works
+        ):
             winner_row = duplicates[0]
             descendant_types = []
             if len(duplicates) > 1:
                 best_work_details = None
                 max_recs = -1
                 for work_row in duplicates:
-                    sub, recs, count, types = get_work_details_recursive(
-                        cursor, work_row["work_id"], stats["label_counter"]
+                    sub, recs, count, types, labels = get_work_details_recursive(
+                        prefetched, work_row.work_id, subtree_cache
                     )
+                    counted_labels.extend(labels)
                     if count > max_recs:
                         max_recs = count
                         winner_row = work_row
@@ -668,31 +946,35 @@ def main():
                     best_work_details
                 )
             else:
-                subworks, recordings, total_recordings, descendant_types = (
+                subworks, recordings, total_recordings, descendant_types, labels = (
                     get_work_details_recursive(
-                        cursor, winner_row["work_id"], stats["label_counter"]
+                        prefetched, winner_row.work_id, subtree_cache
                     )
                 )
+                counted_labels.extend(labels)
 
             if total_recordings > 1:
-                composer_name = winner_row["composer_sort_name"]
+                composer_name = winner_row.composer_sort_name
                 final_work_name = (
-                    winner_row["work_name"]
+                    winner_row.work_name
                 )
-                work_type_str = WORK_TYPES.get(winner_row["work_type"], "Unknown")
+                work_type_str = WORK_TYPES.get(winner_row.work_type, "Unknown")
 
                 # Infer work type from tags first if the work's own type is NULL.
                 # If no useful tag mapping exists, fall back to inferring from child types.
-                if winner_row["work_type"] is None:
+                if winner_row.work_type is None:
                     mapped_from_tag = None
-                    tag_names = winner_row.get("tag_names")
+                    tag_names = winner_row.tag_names
                     if tag_names:
                         # tag_names is a comma-separated string from the SQL query
-                        tag_list = [t.strip().lower() for t in tag_names.split(",") if t and t.strip()]
-                        mapped_types = [TAG_TO_WORK_TYPE[t] for t in tag_list if t in TAG_TO_WORK_TYPE]
+                        mapped_types = Counter()
+                        for tag in tag_names.split(","):
+                            mapped_type = TAG_TO_WORK_TYPE.get(tag.strip().lower())
+                            if mapped_type:
+                                mapped_types[mapped_type] += 1
                         if mapped_types:
                             # pick the most common mapped high-level type among tags
-                            mapped_from_tag = Counter(mapped_types).most_common(1)[0][0]
+                            mapped_from_tag = mapped_types.most_common(1)[0][0]
                             work_type_str = mapped_from_tag
 
                     # If tags didn't yield a mapping, fall back to child-type majority
@@ -703,24 +985,24 @@ def main():
                             work_type_str = WORK_TYPES.get(majority_type_int, "Unknown")
 
                 if composer_id not in composers:
-                    composers[composer_id] = {
-                        "gid": winner_row["composer_gid"],
-                        "name": composer_name,
-                        "birth_year": winner_row["composer_birth_year"],
-                        "death_year": winner_row["composer_death_year"],
-                        "works": [],
-                    }
-
-                work_obj = {
-                    "gid": winner_row["work_gid"],
-                    "name": final_work_name,
-                    "type": work_type_str,
-                    "begin_year": winner_row["work_begin_year"],
-                    "end_year": winner_row["work_end_year"],
-                    "recordings": recordings,
-                    "subworks": subworks,
-                }
-                composers[composer_id]["works"].append(work_obj)
+                    composers[composer_id] = Composer(
+                        gid=winner_row.composer_gid,
+                        name=composer_name,
+                        birth_year=winner_row.composer_birth_year,
+                        death_year=winner_row.composer_death_year,
+                        works=[],
+                    )
+
+                work_obj = Work(
+                    gid=winner_row.work_gid,
+                    name=final_work_name,
+                    type=work_type_str,
+                    begin_year=winner_row.work_begin_year,
+                    end_year=winner_row.work_end_year,
+                    recordings=recordings,
+                    subworks=subworks,
+                )
+                composers[composer_id].works.append(work_obj)
 
                 # Update statistics and print progress
                 stats["total_recordings"] += total_recordings
@@ -738,31 +1020,42 @@ def main():
                 )
                 print(f"{composer_name:<30}\t{truncated_name:<60}\t{total_recordings}")
 
+        stats["label_counter"].update(counted_labels)
+
         # filter composers: if composer is born after 1900, works must have at least two distinct work types not counting "Song", otherwise remove composer
         composers_to_remove = set()
         for composer in list(composers.values()):
-            if composer["birth_year"] and composer["birth_year"] > 1900:
-                distinct_types = set(w["type"] for w in composer["works"])
+            if composer.birth_year and composer.birth_year > 1900:
+                distinct_types = set(w.type for w in composer.works)
                 if "Song" in distinct_types:
                     distinct_types.remove("Song")
                 if len(distinct_types) < 2:
-                    composers_to_remove.add(composer["gid"])
+                    composers_to_remove.add(composer.gid)
                     print(
-                        f"Removing composer {composer['name']} born after 1900 with insufficient work types."
+                        f"Removing composer {composer.name} born after 1900 with insufficient work types."
                     )
 
         final_data = sorted(
-            [c for c in composers.values() if c["works"] and c["gid"] not in composers_to_remove], key=lambda c: c["name"]
+            [c for c in composers.values() if c.works and c.gid not in composers_to_remove], key=lambda c: c.name
         )
         output_filename = "musicbrainz.json"
         print(
             f"\nWriting {len(final_data)} composers with valid works to {output_filename}..."
         )
-        with open(output_filename, "w", encoding="utf-8") as f:
-            json.dump(final_data, f, ensure_ascii=False, indent=2)
+        with open(output_filename, "wb") as f:
+            # One compact composer per line, so only one composer's text is held
+            # in memory at a time.
+            f.write(b"[\n")
+            for i, composer in enumerate(final_data):
+                if i:
+                    f.write(b",\n")
+                f.write(dumps_compact(composer))
+            f.write(b"\n]\n")
 
         print("Done.")
         print_statistics(final_data, stats)
+        cache = normalize_name.cache_info()
+        print(f"normalize_name cache: {cache.hits} hits, {cache.misses} misses ({cache.currsize} names)")
 
     except (Exception, psycopg2.DatabaseError) as error:
         print("An error occurred while processing MusicBrainz data.")